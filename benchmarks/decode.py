@@ -0,0 +1,73 @@
+#compares the summaries decoding paths of api_request
+#usage: python benchmarks/decode.py [--record username ...] [--rounds N]
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+import tracemalloc
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bot
+from samples import PAYLOAD_DIR, load_payloads
+
+def record(usernames: list):
+    os.makedirs(PAYLOAD_DIR, exist_ok=True)
+    for username in usernames:
+        request = urllib.request.Request(bot.SUMMARIES_URL.format(username.lower()),
+                                         headers={"User-Agent": "TAC-helper (https://github.com/funli69/TAC-helper)"})
+        with urllib.request.urlopen(request) as r:
+            body = r.read()
+        with open(os.path.join(PAYLOAD_DIR, f"{username.lower()}.json"), "wb") as f:
+            f.write(body)
+        print(f"recorded {username} ({len(body)} bytes)")
+        time.sleep(1)
+
+def paths():
+    yield "json", json.loads
+    if bot.orjson:
+        yield "orjson", bot.orjson.loads
+
+    pruning = copy.copy(bot.summary_decoder)
+    pruning.decoder = None
+    yield "prune", pruning.decode
+    if bot.msgspec:
+        yield "msgspec", bot.summary_decoder.decode
+
+def run(decode, bodies: list, rounds: int):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for i, body in enumerate(bodies):
+            bot.extract_rows(f"player{i}", None, decode(body))
+    elapsed = time.perf_counter() - started
+
+    #memory is measured separately so tracemalloc does not skew the timing
+    tracemalloc.start()
+    kept = [decode(body) for body in bodies]
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return elapsed / (rounds * len(bodies)), retained, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", nargs="+", metavar="USERNAME", help="save live summaries to benchmarks/payloads first")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record)
+
+    bodies, source = load_payloads()
+    expected = [bot.extract_rows("p", None, json.loads(body)) for body in bodies]
+    print(f"{len(bodies)} {source} payloads, {sum(map(len, bodies)) / len(bodies) / 1024:.1f} KiB average")
+    print(f"{'path':<8} | {'per payload':>12} | {'retained':>10} | {'peak':>10}")
+    for name, decode in paths():
+        assert [bot.extract_rows("p", None, decode(body)) for body in bodies] == expected, name
+        per_payload, retained, peak = run(decode, bodies, args.rounds)
+        print(f"{name:<8} | {per_payload * 1e6:>9.1f} us | {retained / 1024:>7.0f} KiB | {peak / 1024:>7.0f} KiB")
+
+if __name__ == "__main__":
+    main()
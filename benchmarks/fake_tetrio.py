@@ -0,0 +1,79 @@
+#local stand-in for the ch.tetr.io endpoints the bot uses, serving recorded or synthetic summaries
+#usage: python benchmarks/fake_tetrio.py [--port 8780] [--latency 0.02] [--rate-limit 0.01]
+import argparse
+import asyncio
+import json
+import random
+import time
+import zlib
+
+from aiohttp import web
+
+from samples import load_payloads
+
+MATCH_RATE = 0.9 #share of discord ids the search endpoint links to an account
+
+class FakeTetrio:
+    def __init__(self, bodies: list, latency: float = 0.0, rate_limit: float = 0.0, seed: int = 0):
+        #payloads are decoded once so the cache block can be refreshed per response without re-encoding everything
+        self.payloads = [json.loads(body) for body in bodies]
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.limited = 0
+
+    async def respond(self, data: dict):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * (0.5 + self.rng.random()))
+        if self.rate_limit and self.rng.random() < self.rate_limit:
+            self.limited += 1
+            return web.json_response({"success": False, "error": {"msg": "Too many requests"}},
+                                     status=429, headers={"Retry-After": "0.5"})
+        #responses expire immediately so every sweep goes to the server like a cold cache would
+        now = int(time.time() * 1000)
+        return web.json_response({**data, "cache": {"status": "miss", "cached_at": now, "cached_until": now}})
+
+    def payload(self, username: str):
+        return self.payloads[zlib.crc32(username.encode()) % len(self.payloads)]
+
+    async def search(self, request: web.Request):
+        discord_id = request.match_info["query"].rsplit(":", 1)[-1]
+        matched = random.Random(discord_id).random() < MATCH_RATE
+        users = [{"_id": discord_id, "username": f"player{discord_id}"}] if matched else []
+        return await self.respond({"success": True, "data": {"users": users}})
+
+    async def user(self, request: web.Request):
+        username = request.match_info["username"]
+        return await self.respond({"success": True, "data": {"_id": username, "username": username, "role": "user"}})
+
+    async def summaries(self, request: web.Request):
+        payload = self.payload(request.match_info["username"])
+        return await self.respond({"success": True, "data": payload["data"]})
+
+    async def stats(self, request: web.Request):
+        return web.json_response({"requests": self.requests, "limited": self.limited})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/api/users/search/{query}", self.search)
+        app.router.add_get("/api/users/{username}/summaries", self.summaries)
+        app.router.add_get("/api/users/{username}", self.user)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8780)
+    parser.add_argument("--latency", type=float, default=0.02, help="average seconds before each response")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests answered with 429")
+    args = parser.parse_args()
+
+    bodies, source = load_payloads()
+    server = FakeTetrio(bodies, args.latency, args.rate_limit)
+    print(f"Serving {len(bodies)} {source} payloads on port {args.port}", flush=True)
+    web.run_app(server.app(), host="127.0.0.1", port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#summaries payloads for the benchmarks: recorded ones from benchmarks/payloads/*.json, or synthetic ones shaped like TETR.IO's
+import glob
+import json
+import os
+import random
+import time
+
+PAYLOAD_DIR = os.path.join(os.path.dirname(__file__), "payloads")
+RANKS = ['d', 'd+', 'c-', 'c', 'c+', 'b-', 'b', 'b+', 'a-', 'a', 'a+', 's-', 's', 's+', 'ss', 'u', 'x', 'x+']
+
+def record(rng: random.Random, username: str, gamemode: str, stats: dict):
+    return {
+        "_id": f"{rng.getrandbits(96):024x}",
+        "replayid": f"{rng.getrandbits(96):024x}",
+        "stub": False,
+        "gamemode": gamemode,
+        "pb": True,
+        "oncepb": True,
+        "ts": "2025-01-01T00:00:00.000Z",
+        "revolution": None,
+        "user": {"id": f"{rng.getrandbits(96):024x}", "username": username, "avatar_revision": None,
+                 "banner_revision": None, "country": "VN", "supporter": False},
+        "otherusers": [],
+        "leaderboards": ["40l_global", "40l_country_VN"],
+        "results": {
+            "stats": {
+                "lines": 40, "level_lines": 40, "level_lines_needed": 1, "inputs": rng.randint(100, 400),
+                "holds": rng.randint(0, 40), "score": rng.randint(1000, 9000), "zenlevel": 1, "zenprogress": 0,
+                "level": 1, "combo": 0, "topcombo": rng.randint(0, 10), "combopower": 0, "btb": 0, "topbtb": 0,
+                "btbpower": 0, "tspins": 0, "piecesplaced": 100, "kills": 0,
+                "clears": {k: rng.randint(0, 20) for k in ("singles", "doubles", "triples", "quads", "pentas",
+                           "realtspins", "minitspins", "minitspinsingles", "tspinsingles", "minitspindoubles",
+                           "tspindoubles", "minitspintriples", "tspintriples", "minitspinquads", "tspinquads",
+                           "tspinpentas", "allclear")},
+                "garbage": {"sent": 0, "sent_nomult": 0, "maxspike": 0, "maxspike_nomult": 0, "received": 0,
+                            "attack": 0, "cleared": 0},
+                "finesse": {"combo": rng.randint(0, 100), "faults": rng.randint(0, 20), "perfectpieces": 90},
+                **stats,
+            },
+            "aggregatestats": {"apm": rng.random() * 100, "pps": rng.random() * 3, "vsscore": rng.random() * 200},
+            "gameoverreason": "winner",
+        },
+        "extras": {},
+        "disputed": False,
+    }
+
+def league(rng: random.Random, username: str):
+    rank = rng.choice(RANKS)
+    entry = {
+        "gamesplayed": rng.randint(10, 5000), "gameswon": rng.randint(0, 2500), "glicko": rng.random() * 4000,
+        "rd": 60 + rng.random() * 30, "decaying": False, "tr": rng.random() * 25000, "gxe": rng.random() * 100,
+        "rank": rank, "bestrank": rank, "apm": rng.random() * 200, "pps": rng.random() * 4, "vs": rng.random() * 400,
+        "standing": rng.randint(1, 50000), "standing_local": rng.randint(1, 500), "percentile": rng.random(),
+        "percentile_rank": rank, "next_rank": None, "prev_rank": None, "next_at": -1, "prev_at": -1,
+    }
+    entry["past"] = {str(season): {"season": str(season), "username": username, "country": "VN",
+                                   "placement": rng.randint(1, 50000), "gamesplayed": 100, "gameswon": 50,
+                                   "glicko": 2000, "gxe": 50, "tr": rng.random() * 25000, "rd": 60,
+                                   "rank": rng.choice(RANKS), "bestrank": rng.choice(RANKS), "apm": 50, "pps": 1.5,
+                                   "vs": 100, "ranked": True}
+                     for season in range(1, 3)}
+    return entry
+
+def synthetic_summary(rng: random.Random, username: str):
+    zenith = lambda: {"record": record(rng, username, "zenith", {"zenith": {"altitude": rng.random() * 1500,
+                                                                          "rank": 1, "peakrank": 1,
+                                                                          "avgrankpts": 0, "floor": 5,
+                                                                          "targetingfactor": 3,
+                                                                          "targetinggrace": 0,
+                                                                          "totalbonus": 0, "revives": 0,
+                                                                          "revivesTotal": 0,
+                                                                          "speedrun": False,
+                                                                          "speedrun_seen": False,
+                                                                          "splits": [0] * 9}}),
+                      "rank": rng.randint(1, 50000), "rank_local": rng.randint(1, 500),
+                      "best": {"record": record(rng, username, "zenith", {"zenith": {"altitude": rng.random() * 1500}}),
+                               "rank": rng.randint(1, 50000)}}
+    return {
+        "success": True,
+        "data": {
+            "40l": {"record": record(rng, username, "40l", {"finaltime": 20000 + rng.random() * 100000}),
+                    "rank": rng.randint(1, 50000), "rank_local": rng.randint(1, 500)},
+            "blitz": {"record": record(rng, username, "blitz", {"score": rng.randint(10000, 900000)}),
+                      "rank": rng.randint(1, 50000), "rank_local": rng.randint(1, 500)},
+            "zenith": zenith(),
+            "zenithex": zenith(),
+            "league": league(rng, username),
+            "zen": {"level": rng.randint(1, 100), "score": rng.randint(0, 10 ** 7)},
+            "achievements": [{"k": i, "o": i, "rt": 1, "vt": 1, "min": 0, "deci": 0, "name": f"Achievement {i}",
+                              "object": "object", "category": "general", "hidden": False, "art": "",
+                              "nolb": False, "desc": "description of the achievement " * 2, "n": "",
+                              "sId": 0, "v": rng.random() * 1000, "a": 0, "t": 0, "pos": rng.randint(1, 9999),
+                              "total": 10000, "rank": rng.randint(0, 5)}
+                             for i in range(80)],
+        },
+        "cache": {"status": "hit", "cached_at": int(time.time() * 1000), "cached_until": int(time.time() * 1000) + 60000},
+    }
+
+def load_payloads(count: int = 200, seed: int = 0):
+    recorded = sorted(glob.glob(os.path.join(PAYLOAD_DIR, "*.json")))
+    if recorded:
+        bodies = []
+        for path in recorded:
+            with open(path, "rb") as f:
+                bodies.append(f.read())
+        return bodies, "recorded"
+
+    rng = random.Random(seed)
+    return [json.dumps(synthetic_summary(rng, f"player{i}")).encode() for i in range(count)], "synthetic"
@@ -0,0 +1,177 @@
+#offline throughput benchmark: member discovery and a data_update sweep against benchmarks/fake_tetrio.py
+#usage: python benchmarks/sweep.py [--users 100 1000 10000] [--latency 0.02] [--rate-limit 0.01]
+#                                  [--save baseline.json | --compare baseline.json]
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class FakeMember:
+    def __init__(self, member_id: int):
+        self.id = member_id
+
+class FakeGuild:
+    def __init__(self, guild_id: int, size: int):
+        self.id = guild_id
+        self.members = [FakeMember(10 ** 17 + i) for i in range(size)]
+
+    async def fetch_members(self, limit=None, after=None):
+        for member in self.members:
+            if after is None or member.id > after.id:
+                yield member
+
+    def get_member(self, member_id: int):
+        return None
+
+async def measure(users: int, port: int, rate: float):
+    sys.path.insert(0, os.path.dirname(HERE))
+    import bot
+
+    base = f"http://127.0.0.1:{port}/api/users"
+    bot.SEARCH_URL = base + "/search/discord:id:{}"
+    bot.USER_URL = base + "/{}"
+    bot.SUMMARIES_URL = base + "/{}/summaries"
+    bot.REFRESH_BUDGET_PER_MIN = users
+    #the real limiter would make this a benchmark of API_RATE, the bot's own overhead is what is measured here
+    bot.api_limiter = bot.TokenBucket(rate=rate, capacity=int(rate), min_rate=rate / 10)
+
+    async def ready():
+        pass
+    bot.bot.wait_until_ready = ready
+
+    #discovery writes through its own connection rather than a BatchWriter, so time the writer itself
+    write_time = 0.0
+    connect_db = bot.connect_db
+    @contextlib.asynccontextmanager
+    async def timed_connect_db(readonly: bool = False):
+        nonlocal write_time
+        started = time.perf_counter()
+        async with connect_db(readonly) as db:
+            yield db
+        if not readonly:
+            write_time += time.perf_counter() - started
+    bot.connect_db = timed_connect_db
+
+    def served():
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats") as r:
+            return json.loads(r.read())["requests"]
+
+    await bot.init_db()
+    await bot.db_pool.open()
+    await bot.response_cache.open()
+    await bot.load_fingerprints()
+    await bot.load_search_misses()
+
+    result = {"users": users}
+    try:
+        for phase, run in (("discovery", lambda: bot.discover_members(FakeGuild(1, users))),
+                           ("sweep", bot.refresh_due_users)):
+            requests = served()
+            write_time = 0.0
+            started = time.perf_counter()
+            await run()
+            elapsed = time.perf_counter() - started
+            requests = served() - requests
+            result[phase] = {"wall": elapsed, "requests": requests, "rps": requests / elapsed, "db_write": write_time}
+    finally:
+        if bot.session:
+            await bot.session.close()
+        await bot.response_cache.close()
+        await bot.db_pool.close()
+
+    async with bot.connect_db(readonly=True) as db:
+        async with db.execute("SELECT COUNT(*) FROM tl") as c:
+            result["tl_rows"] = (await c.fetchone())[0]
+    await bot.db_pool.close()
+
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+def child(args):
+    logging.disable(logging.WARNING) #per-user info logs would dominate the output of a 10k run
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        result = asyncio.run(measure(args.child, args.port, args.rate))
+    print(json.dumps(result))
+
+def run_size(users: int, args):
+    #one process per size so peak RSS is not carried over from a larger run
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", str(users),
+                          "--port", str(args.port), "--rate", str(args.rate)],
+                         check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def report(result: dict):
+    for phase in ("discovery", "sweep"):
+        stats = result[phase]
+        print(f"{result['users']:>6} | {phase:<9} | {stats['wall']:>7.2f}s | {stats['requests']:>8} | "
+              f"{stats['rps']:>7.0f} | {stats['db_write']:>7.2f}s | {result['peak_rss_mb']:>6.0f}MB", flush=True)
+
+def compare(results: list, path: str, tolerance: float):
+    with open(path) as f:
+        baseline = {result["users"]: result for result in json.load(f)}
+
+    regressions = []
+    for result in results:
+        before = baseline.get(result["users"])
+        if before is None:
+            continue
+        for phase in ("discovery", "sweep"):
+            if result[phase]["wall"] > before[phase]["wall"] * (1 + tolerance):
+                regressions.append(f"{result['users']} users {phase}: {before[phase]['wall']:.2f}s -> {result[phase]['wall']:.2f}s")
+        if result["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{result['users']} users peak RSS: {before['peak_rss_mb']:.0f}MB -> {result['peak_rss_mb']:.0f}MB")
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return not regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--latency", type=float, default=0.02, help="average fake API latency in seconds")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--rate", type=float, default=1000, help="requests per second allowed by the limiter")
+    parser.add_argument("--port", type=int, default=8780)
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="fail if slower than this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_tetrio.py"), "--port", str(args.port),
+                               "--latency", str(args.latency), "--rate-limit", str(args.rate_limit)],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        print(server.stdout.readline().strip())
+        print(f"{'users':>6} | {'phase':<9} | {'wall':>8} | {'requests':>8} | {'req/s':>7} | {'db write':>8} | {'peak RSS':>8}")
+        results = []
+        for users in args.users:
+            results.append(run_size(users, args))
+            report(results[-1])
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,42 @@ import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 import aiohttp
+from aiohttp import web
 import aiosqlite
 import uuid
+import bisect
+import functools
+import hashlib
+import heapq
+import json
+import csv
+import gzip
+import io
+import shutil
+import sqlite3
+import tempfile
+import zipfile
 import random
 import time
 import asyncio
 import os
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Optional, NamedTuple
 from datetime import datetime, timedelta, timezone
 import logging
 from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
 
 #=============== setups ===============#
 intents = discord.Intents.default()
@@ -23,6 +48,59 @@ bot = commands.Bot(command_prefix='-', intents=intents, help_command=None)
 SEARCH_URL = 'https://ch.tetr.io/api/users/search/discord:id:{}'
 USER_URL   = "https://ch.tetr.io/api/users/{}"
 SUMMARIES_URL = "https://ch.tetr.io/api/users/{}/summaries"
+LEAGUE_URL = "https://ch.tetr.io/api/users/by/league?limit=100&after={}"
+
+DB_PATH = "db.db"
+DB_READERS = 4
+
+API_RATE  = 3.0 #requests per second shared by every api_request call
+API_BURST = 6
+API_MIN_RATE = 0.25 #floor the limiter backs off to after 429s
+
+BREAKER_THRESHOLD = 5 #consecutive 5xx/network failures before the circuit opens
+BREAKER_COOLDOWN = 60 #seconds the circuit stays open before a probe request
+REFRESH_WORKERS = 6
+
+API_CACHE_PATH = "api_cache.db" #on-disk tier for cached responses, None to keep them in memory only
+API_CACHE_SIZE = 4096           #responses kept in memory
+API_CACHE_PRUNE_INTERVAL = 10 * 60 #seconds between deletions of expired rows from the on-disk tier
+API_CACHE_REVALIDATE_TTL = 60      #seconds a 304 keeps a response fresh when the headers give no max-age
+
+PROFILE_CACHE_SIZE = 2048
+PROFILE_CACHE_TTL = 10 * 60 #seconds
+
+ROLE_EDIT_RATE = 1.0 #member role edits per second
+ROLE_EDIT_BURST = 5
+
+ANNOUNCE_CHANNELS = []    #channel ids that receive rank-up and PB announcements
+ANNOUNCE_INTERVAL = 60    #seconds of events batched into one message per channel
+ANNOUNCE_QUEUE_SIZE = 10000
+
+METRICS_ENABLED = True #record timings and counters for -stats and /metrics
+METRICS_PORT = None    #port to serve Prometheus /metrics on localhost, None to only use -stats
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300) #seconds
+
+DISCOVERY_CHUNK = 100 #members scanned between saved discovery cursors
+
+SEARCH_MISS_TTL = 6 * 60 * 60          #seconds before an unlinked member is searched again
+SEARCH_MISS_MAX_TTL = 7 * 24 * 60 * 60 #cap for the doubling TTL
+
+REFRESH_MIN_INTERVAL = 5 * 60        #seconds, for players whose stats just changed
+REFRESH_MAX_INTERVAL = 24 * 60 * 60  #seconds, for dormant accounts
+REFRESH_BUDGET_PER_MIN = 60          #summaries requests data_update may spend per minute
+
+BULK_TL_REFRESH = True    #refresh tl from the league leaderboard instead of one summaries call per player
+BULK_TL_INTERVAL = 10 * 60 #seconds between league sweeps
+BULK_TR_MARGIN = 100       #TR above a player's last known TR where a leaderboard window starts
+BULK_WINDOW_PAGES = 5      #pages walked from one window start before jumping to the next player
+BULK_MAX_PAGES = 100       #pages per league sweep
+
+HISTORY_RAW_RETENTION = 7 * 24 * 60 * 60       #seconds raw tl_history points are kept before hourly rollup
+HISTORY_HOURLY_RETENTION = 90 * 24 * 60 * 60   #seconds hourly points are kept before daily rollup
+HISTORY_DAILY_RETENTION = 730 * 24 * 60 * 60   #seconds daily points are kept
+
+WRITE_BATCH_SIZE = 50      #summaries per transaction
+WRITE_FLUSH_INTERVAL = 10  #seconds
 
 ALLOWED_GUILD = [946060638231359588, #TAC
                  854031901718609962  #test server
@@ -56,56 +134,432 @@ rank_to_role = {
     ,'x+': 'X+ Rank'
 }
 
+LEADERBOARD_PAGE_SIZE = 15
+TOURNAMENT_PAGE_SIZE = 10
+DUMP_BATCH_SIZE = 500 #rows fetched per cursor step when exporting the database
+
+leaderboards = { #category: (table, column, order, title)
+     'tr'      : ('tl'      , 'tr'        , 'DESC', 'TR')
+    ,'40l'     : ('40l'     , 'time'      , 'ASC' , '40 Lines')
+    ,'blitz'   : ('blitz'   , 'score'     , 'DESC', 'Blitz')
+    ,'zenith'  : ('zenith'  , 'b_altitude', 'DESC', 'Quick Play')
+    ,'zenithex': ('zenithex', 'b_altitude', 'DESC', 'Expert Quick Play')
+    ,'zen'     : ('zen'     , 'xp'        , 'DESC', 'Zen')
+}
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s: %(message)s'
 )
 
-temp_bl = set() #blacklisted ids
+search_misses = {} #discord_id -> (failures, expires) of tetrio searches that found nothing
+fingerprints = {} #(tetrio_username, table) -> hash of the rows last written
+league_covered = {} #tetrio_username -> when the last league sweep found the player
+role_cache = {}     #guild_id -> {role name: role} for the rank roles
+synced_ranks = {}   #discord_id -> rank whose role was last applied
+role_queue = asyncio.Queue() #(discord_id or None, tetrio_username, rank) waiting for a role sync
+role_sync_task: Optional[asyncio.Task] = None
+announce_queue = asyncio.Queue(maxsize=ANNOUNCE_QUEUE_SIZE) #ChangeEvent waiting to be announced
+announce_task: Optional[asyncio.Task] = None
+tournament_task: Optional[asyncio.Task] = None
+metrics_runner: Optional[web.AppRunner] = None
+refresh_pass: Optional[asyncio.Task] = None #data_update pass that may outlive its tick
+sweep_durations = {} #task name -> seconds the last pass took
 
 session: Optional[aiohttp.ClientSession] = None
+inflight_requests = {} #url -> task shared by concurrent api_request callers
 
-tables = {
+tables = { #table: {column: (path in the summaries response, default)}, or a single (path, default)
     "users": {
-        "country": lambda rsp: safe_get(rsp, "data", "country", default="null"),
-        "ar"     : lambda rsp: safe_get(rsp, "data", "ar", default=0)
+        "country": (("data", "country"), "null"),
+        "ar"     : (("data", "ar"), 0)
     },
     "tl": {
-        "rd"       : lambda rsp: safe_get(rsp, "data", "league", "rd", default=-1),
-        "tr"       : lambda rsp: safe_get(rsp, "data", "league", "tr", default=-1),
-        "rank"     : lambda rsp: safe_get(rsp, "data", "league", "rank", default="z"),
-        "best_rank": lambda rsp: safe_get(rsp, "data", "league", "best_rank", default="null"),
-        "apm"      : lambda rsp: safe_get(rsp, "data", "league", "apm", default=-1),
-        "pps"      : lambda rsp: safe_get(rsp, "data", "league", "pps", default=-1),
-        "vs"       : lambda rsp: safe_get(rsp, "data", "league", "vs", default=-1)
+        "rd"       : (("data", "league", "rd"), -1),
+        "tr"       : (("data", "league", "tr"), -1),
+        "rank"     : (("data", "league", "rank"), "z"),
+        "best_rank": (("data", "league", "best_rank"), "null"),
+        "apm"      : (("data", "league", "apm"), -1),
+        "pps"      : (("data", "league", "pps"), -1),
+        "vs"       : (("data", "league", "vs"), -1)
     },
-    "tl_past": lambda rsp: safe_get(rsp, "data", "league", "past", default={}),
+    "tl_past": (("data", "league", "past"), {}),
     "40l": {
-        "id"  : lambda rsp: safe_get(rsp, "data", "40l", "record", "replayid", default="null"),
-        "time": lambda rsp: safe_get(rsp, "data", "40l", "record", "results", "stats", "finaltime", default=-1)
+        "id"  : (("data", "40l", "record", "replayid"), "null"),
+        "time": (("data", "40l", "record", "results", "stats", "finaltime"), -1)
     },
     "blitz": {
-        "id"   : lambda rsp: safe_get(rsp, "data", "blitz", "record", "replayid", default="null"),
-        "score": lambda rsp: safe_get(rsp, "data", "blitz", "record", "results", "stats", "score", default=-1)
+        "id"   : (("data", "blitz", "record", "replayid"), "null"),
+        "score": (("data", "blitz", "record", "results", "stats", "score"), -1)
     },
     "zenith": {
-        "w_id"      : lambda rsp: safe_get(rsp, "data", "zenith", "record", "replayid", default=None),
-        "w_altitude": lambda rsp: safe_get(rsp, "data", "zenith", "record", "results", "stats", "zenith", "altitude", default=-1),
-        "b_id"      : lambda rsp: safe_get(rsp, "data", "zenith", "best", "record", "replayid", default=None),
-        "b_altitude": lambda rsp: safe_get(rsp, "data", "zenith", "best", "record", "results", "stats", "zenith", "altitude", default=-1)
+        "w_id"      : (("data", "zenith", "record", "replayid"), None),
+        "w_altitude": (("data", "zenith", "record", "results", "stats", "zenith", "altitude"), -1),
+        "b_id"      : (("data", "zenith", "best", "record", "replayid"), None),
+        "b_altitude": (("data", "zenith", "best", "record", "results", "stats", "zenith", "altitude"), -1)
     },
     "zenithex": {
-        "w_id"      : lambda rsp: safe_get(rsp, "data", "zenithex", "record", "replayid", default=None),
-        "w_altitude": lambda rsp: safe_get(rsp, "data", "zenithex", "record", "results", "stats", "zenith", "altitude", default=-1),
-        "b_id"      : lambda rsp: safe_get(rsp, "data", "zenithex", "best", "record", "replayid", default=None),
-        "b_altitude": lambda rsp: safe_get(rsp, "data", "zenithex", "best", "record", "results", "stats", "zenith", "altitude", default=-1)
+        "w_id"      : (("data", "zenithex", "record", "replayid"), None),
+        "w_altitude": (("data", "zenithex", "record", "results", "stats", "zenith", "altitude"), -1),
+        "b_id"      : (("data", "zenithex", "best", "record", "replayid"), None),
+        "b_altitude": (("data", "zenithex", "best", "record", "results", "stats", "zenith", "altitude"), -1)
     },
-    "zen": lambda rsp: safe_get(rsp, "data", "score", default=-1)
+    "zen": (("data", "zen", "score"), -1)
 }
 
 #=============== functions ===============#
+metric_registry = []
+
+def metric_labels(names: tuple, values: tuple):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, values)) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+        metric_registry.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        if METRICS_ENABLED:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def values(self):
+        return self.series
+
+    def summary(self, value):
+        return f"{value:g}"
+
+    def samples(self):
+        return [(self.name, metric_labels(self.labels, labels), value) for labels, value in self.values().items()]
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}",
+                *(f"{name}{labels} {value}" for name, labels, value in self.samples())]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self.read = read #returns {label values: value}, only called when metrics are read
+
+    def values(self):
+        return self.read()
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        if not METRICS_ENABLED:
+            return
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2) #one count per bucket, +Inf, then the sum
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def quantile(self, series: list, q: float):
+        count = sum(series[:-1])
+        seen = 0
+        for bound, n in zip((*self.buckets, float("inf")), series):
+            seen += n
+            if seen >= q * count:
+                return bound
+        return float("inf")
+
+    def summary(self, series: list):
+        count = sum(series[:-1])
+        return (f"n={count} avg={series[-1] / count:.3f}s "
+                f"p50<={self.quantile(series, 0.5):g}s p95<={self.quantile(series, 0.95):g}s")
+
+    def samples(self):
+        samples = []
+        for labels, series in self.series.items():
+            total = 0
+            for bound, n in zip((*self.buckets, "+Inf"), series):
+                total += n
+                samples.append((f"{self.name}_bucket", metric_labels((*self.labels, "le"), (*labels, bound)), total))
+            samples.append((f"{self.name}_sum", metric_labels(self.labels, labels), series[-1]))
+            samples.append((f"{self.name}_count", metric_labels(self.labels, labels), total))
+        return samples
+
+def render_metrics():
+    return "\n".join(line for metric in metric_registry for line in metric.render()) + "\n"
+
+def endpoint_name(url: str):
+    if "/search/" in url:
+        return "search"
+    if url.endswith("/summaries"):
+        return "summaries"
+    if "/by/league" in url:
+        return "league"
+    return "user"
+
+def loop_interval(loop: tasks.Loop):
+    return (loop.hours or 0) * 3600 + (loop.minutes or 0) * 60 + (loop.seconds or 0)
+
+api_latency = Histogram("tac_api_request_seconds", "Time until TETR.IO answered one HTTP attempt", ("endpoint",))
+api_responses = Counter("tac_api_responses_total", "HTTP attempts by endpoint and status", ("endpoint", "status"))
+api_retries = Counter("tac_api_retries_total", "Retried attempts by endpoint and reason", ("endpoint", "reason"))
+api_cache_lookups = Counter("tac_api_cache_lookups_total", "api_request calls answered from cache, a shared in-flight request, or the network", ("result",))
+db_write_time = Histogram("tac_db_write_seconds", "Time spent writing one table of a batch, or committing it", ("table",))
+sweep_time = Histogram("tac_sweep_seconds", "Duration of one pass of a background task", ("task",))
+sweep_skips = Counter("tac_sweep_skipped_total", "Ticks skipped because the previous pass was still running", ("task",))
+Gauge("tac_sweep_last_seconds", "Duration of the last pass of a background task", lambda: {(task,): seconds for task, seconds in sweep_durations.items()}, ("task",))
+Gauge("tac_sweep_interval_seconds", "Configured interval of a background task", lambda: {
+    ("data_update",): loop_interval(data_update),
+    ("league_update",): loop_interval(league_update),
+}, ("task",))
+Gauge("tac_queue_depth", "Items waiting in background queues", lambda: {
+    ("role_sync",): role_queue.qsize(),
+    ("announce",): announce_queue.qsize(),
+    ("inflight_requests",): len(inflight_requests),
+    ("tournament_deadlines",): len(tournament_scheduler.heap),
+}, ("queue",))
+Gauge("tac_cache_lookups", "Profile and response cache lookups since start", lambda: {
+    ("profile", "hit"): profile_cache.hits,
+    ("profile", "miss"): profile_cache.misses,
+    ("response", "entries"): len(response_cache.entries),
+}, ("cache", "result"))
+
+async def serve_metrics(request: web.Request):
+    return web.Response(text=render_metrics(), content_type="text/plain")
+
+async def start_metrics_server():
+    global metrics_runner
+    if METRICS_PORT is None or metrics_runner is not None:
+        return
+
+    app = web.Application()
+    app.router.add_get("/metrics", serve_metrics)
+    metrics_runner = web.AppRunner(app)
+    await metrics_runner.setup()
+    await web.TCPSite(metrics_runner, "127.0.0.1", METRICS_PORT).start()
+    logging.info(f"Serving metrics on http://127.0.0.1:{METRICS_PORT}/metrics")
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int, min_rate: Optional[float] = None):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate or rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, delay: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        #nothing refills while paused, otherwise a full burst goes out the moment it ends
+        self.updated = max(self.updated, self.paused_until)
+
+    def throttle(self, delay: float):
+        self.pause(delay)
+        self.tokens = 0
+        self.rate = max(self.rate / 2, self.min_rate)
+
+    def recover(self):
+        self.rate = min(self.rate + self.max_rate * 0.05, self.max_rate)
+
+    def observe(self, headers):
+        remaining = headers.get("X-RateLimit-Remaining") or headers.get("RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset") or headers.get("RateLimit-Reset")
+        if remaining is None or reset is None:
+            return False
+
+        try:
+            remaining, reset = float(remaining), float(reset)
+        except ValueError:
+            return False
+
+        if reset > 1e9: #epoch timestamp rather than seconds left
+            reset -= time.time()
+
+        if remaining <= 0:
+            self.pause(max(reset, 0))
+        elif reset > 0:
+            self.rate = min(max(remaining / reset, self.min_rate), self.max_rate)
+        return True
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if self.paused_until > now:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+api_limiter = TokenBucket(rate=API_RATE, capacity=API_BURST, min_rate=API_MIN_RATE)
+
+class CircuitBreaker:
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+            return False
+        self.probing = True
+        return True
+
+    def success(self):
+        if self.opened_at is not None:
+            logging.info("TETR.IO circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def abandon(self):
+        #a probe that ended without a verdict (429, cancellation, bad body) starts a new cooldown instead of blocking forever
+        if self.probing:
+            self.probing = False
+            self.opened_at = time.monotonic()
+
+    def failure(self):
+        self.failures += 1
+        if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+            logging.warning(f"TETR.IO circuit open after {self.failures} failures, pausing requests for {self.cooldown}s")
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+api_breaker = CircuitBreaker(threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN)
+
+class ResponseCache:
+    def __init__(self, path: Optional[str], size: int):
+        self.path = path
+        self.size = size
+        self.entries = OrderedDict() #url -> (cached_until in ms, etag, data)
+        self.db: Optional[aiosqlite.Connection] = None
+        self.last_prune = time.monotonic()
+
+    async def open(self):
+        if self.path is None or self.db is not None:
+            return
+
+        self.db = await aiosqlite.connect(self.path)
+        await self.db.execute("PRAGMA journal_mode = WAL;")
+        await self.db.execute("PRAGMA synchronous = NORMAL;")
+        await self.db.execute('''
+                              CREATE TABLE IF NOT EXISTS api_cache(
+                              url TEXT PRIMARY KEY,
+                              cached_until INTEGER,
+                              etag TEXT,
+                              body TEXT
+                              )
+                              ''')
+        await self.prune()
+
+        async with self.db.execute("SELECT url, cached_until, etag, body FROM api_cache ORDER BY cached_until DESC LIMIT ?", (self.size,)) as c:
+            async for url, cached_until, etag, body in c:
+                self.entries[url] = (cached_until, etag, json_loads(body))
+        logging.info(f"Loaded {len(self.entries)} cached API responses from {self.path}")
+
+    async def prune(self):
+        self.last_prune = time.monotonic()
+        await self.db.execute("DELETE FROM api_cache WHERE cached_until < ? AND etag IS NULL", (int(time.time() * 1000),))
+        await self.db.commit()
+
+    async def close(self):
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+
+    def get(self, url: str):
+        entry = self.entries.get(url)
+        if entry is None or entry[0] <= time.time() * 1000:
+            return None
+        self.entries.move_to_end(url)
+        return entry[2]
+
+    def stale(self, url: str):
+        return self.entries.get(url)
+
+    async def refresh(self, url: str, cached_until: int):
+        entry = self.entries.get(url)
+        if entry is None:
+            return
+        self.entries[url] = (cached_until, entry[1], entry[2])
+        self.entries.move_to_end(url)
+
+        if self.db is not None:
+            try:
+                await self.db.execute("UPDATE api_cache SET cached_until = ? WHERE url = ?", (cached_until, url))
+                await self.db.commit()
+            except Exception as e:
+                logging.error(f"[ResponseCache] Failed to refresh {url}: {type(e).__name__}: {e}")
+
+    async def put(self, url: str, data: dict, etag: Optional[str] = None):
+        cached_until = safe_get(data, "cache", "cached_until", default=0)
+        if not cached_until and not etag:
+            return
+
+        self.entries[url] = (cached_until, etag, data)
+        self.entries.move_to_end(url)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+        if self.db is not None:
+            try:
+                await self.db.execute("INSERT OR REPLACE INTO api_cache(url, cached_until, etag, body) VALUES (?, ?, ?, ?)",
+                                      (url, cached_until, etag, json_dumps(data)))
+                await self.db.commit()
+                if time.monotonic() - self.last_prune > API_CACHE_PRUNE_INTERVAL:
+                    await self.prune()
+            except Exception as e:
+                logging.error(f"[ResponseCache] Failed to persist {url}: {type(e).__name__}: {e}")
+
+response_cache = ResponseCache(API_CACHE_PATH, API_CACHE_SIZE)
+
+async def run_pool(items, handler, workers: int = REFRESH_WORKERS):
+    queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            try:
+                await handler(item)
+            except Exception as e:
+                logging.error(f"[run_pool] {handler.__name__} failed for {item}: {type(e).__name__}: {e}")
+            finally:
+                queue.task_done()
+
+    pool = [asyncio.create_task(worker()) for _ in range(min(workers, queue.qsize()))]
+    try:
+        await queue.join()
+    finally:
+        for task in pool:
+            task.cancel()
+        await asyncio.gather(*pool, return_exceptions=True)
+
 async def init_db():
-    async with aiosqlite.connect('db.db') as db:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("PRAGMA journal_mode = WAL;")
         await db.execute('''
                          CREATE TABLE IF NOT EXISTS users(
                          discord_id TEXT PRIMARY KEY,
@@ -228,17 +682,510 @@ async def init_db():
                          )
                          ''')
         
+        await db.execute('''
+                         CREATE TABLE IF NOT EXISTS refresh_schedule(
+                         tetrio_username TEXT PRIMARY KEY,
+                         next_refresh INTEGER,
+                         refresh_interval INTEGER,
+                         last_change INTEGER,
+                         last_refresh INTEGER,
+                         FOREIGN KEY(tetrio_username) REFERENCES users(tetrio_username)
+                         )
+                         ''')
+
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_refresh_schedule_next ON refresh_schedule(next_refresh)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_tournament_date ON tournament(date, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_tournament_regis_start ON tournament(regis_start)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_tournament_regis_end ON tournament(regis_end)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_tournament_regis_id ON tournament_regis(id)")
+
+        for table, column, _, _ in leaderboards.values():
+            await db.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table}_{column}" ON "{table}"({column}, tetrio_username)')
+
+        await db.execute('''
+                         CREATE TABLE IF NOT EXISTS tl_history(
+                         tetrio_username TEXT,
+                         ts INTEGER,
+                         tr REAL,
+                         rank TEXT,
+                         apm REAL,
+                         pps REAL,
+                         vs REAL,
+                         PRIMARY KEY(tetrio_username, ts),
+                         FOREIGN KEY(tetrio_username) REFERENCES users(tetrio_username)
+                         ) WITHOUT ROWID
+                         ''')
+
+        for rollup in ("tl_history_hourly", "tl_history_daily"):
+            await db.execute(f'''
+                             CREATE TABLE IF NOT EXISTS {rollup}(
+                             tetrio_username TEXT,
+                             ts INTEGER,
+                             tr_min REAL,
+                             tr_max REAL,
+                             tr REAL,
+                             rank TEXT,
+                             apm REAL,
+                             pps REAL,
+                             vs REAL,
+                             samples INTEGER,
+                             PRIMARY KEY(tetrio_username, ts),
+                             FOREIGN KEY(tetrio_username) REFERENCES users(tetrio_username)
+                             ) WITHOUT ROWID
+                             ''')
+
+        for history in ("tl_history", "tl_history_hourly", "tl_history_daily"):
+            await db.execute(f"CREATE INDEX IF NOT EXISTS idx_{history}_ts ON {history}(ts)")
+
+        await db.execute('''
+                         CREATE VIEW IF NOT EXISTS tl_history_all AS
+                         SELECT tetrio_username, ts, tr, rank, apm, pps, vs, 'raw' AS resolution FROM tl_history
+                         UNION ALL
+                         SELECT tetrio_username, ts, tr, rank, apm, pps, vs, 'hourly' FROM tl_history_hourly
+                         UNION ALL
+                         SELECT tetrio_username, ts, tr, rank, apm, pps, vs, 'daily' FROM tl_history_daily
+                         ''')
+
+        await db.execute('''
+                         CREATE TABLE IF NOT EXISTS search_misses(
+                         discord_id TEXT PRIMARY KEY,
+                         failures INTEGER,
+                         expires INTEGER
+                         )
+                         ''')
+
+        await db.execute('''
+                         CREATE TABLE IF NOT EXISTS fingerprints(
+                         tetrio_username TEXT,
+                         tbl TEXT,
+                         hash TEXT,
+                         PRIMARY KEY(tetrio_username, tbl),
+                         FOREIGN KEY(tetrio_username) REFERENCES users(tetrio_username)
+                         )
+                         ''')
+
         await db.commit()
 
+class ConnectionPool:
+    def __init__(self, path: str, readers: int):
+        self.path = path
+        self.size = readers
+        self.writer: Optional[aiosqlite.Connection] = None
+        self.readers = asyncio.Queue()
+        self.write_lock = asyncio.Lock()
+        self.open_lock = asyncio.Lock()
+
+    async def connect(self, readonly: bool = False):
+        db = await aiosqlite.connect(self.path)
+        db.row_factory = aiosqlite.Row
+        await db.execute("PRAGMA journal_mode = WAL;")
+        await db.execute("PRAGMA synchronous = NORMAL;")
+        await db.execute("PRAGMA foreign_keys = ON;")
+        await db.execute("PRAGMA busy_timeout = 5000;")
+        await db.execute("PRAGMA mmap_size = 268435456;")
+        await db.execute("PRAGMA cache_size = -16000;")
+        if readonly:
+            await db.execute("PRAGMA query_only = ON;")
+        return db
+
+    async def open(self):
+        async with self.open_lock:
+            if self.writer is not None:
+                return
+            for _ in range(self.size):
+                self.readers.put_nowait(await self.connect(readonly=True))
+            self.writer = await self.connect()
+            logging.info(f"Opened database pool on {self.path} (1 writer, {self.size} readers)")
+
+    async def close(self):
+        async with self.open_lock:
+            if self.writer is None:
+                return
+            async with self.write_lock:
+                await self.writer.close()
+                self.writer = None
+            for _ in range(self.size):
+                await (await self.readers.get()).close()
+
+db_pool = ConnectionPool(DB_PATH, DB_READERS)
+
 @asynccontextmanager
-async def connect_db():
-    db = await aiosqlite.connect("db.db")
-    await db.execute("PRAGMA foreign_keys = ON;")
-    db.row_factory = aiosqlite.Row
-    try:
-        yield db
-    finally:
-        await db.close()   
+async def connect_db(readonly: bool = False):
+    if db_pool.writer is None:
+        await db_pool.open()
+
+    if readonly:
+        db = await db_pool.readers.get()
+        try:
+            yield db
+        finally:
+            db_pool.readers.put_nowait(db)
+        return
+
+    async with db_pool.write_lock:
+        db = db_pool.writer
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                await db.rollback()
+
+class ProfileCache:
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict() #discord_id -> (expires, profile)
+        self.usernames = {}          #tetrio_username -> discord_id
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, discord_id: Optional[str] = None, username: Optional[str] = None):
+        if discord_id is None:
+            discord_id = self.usernames.get(username)
+
+        entry = self.entries.get(discord_id)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(discord_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, profile: dict):
+        discord_id = profile["discord_id"]
+        self.invalidate(discord_id)
+        self.entries[discord_id] = (time.monotonic() + self.ttl, profile)
+        self.usernames[profile["tetrio_username"]] = discord_id
+
+        while len(self.entries) > self.size:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.usernames.pop(evicted["tetrio_username"], None)
+
+    def invalidate(self, discord_id: str):
+        entry = self.entries.pop(discord_id, None)
+        if entry:
+            self.usernames.pop(entry[1]["tetrio_username"], None)
+
+    def write(self, table: str, rows: list):
+        if table not in ("users", "tl"):
+            return
+
+        columns = table_columns(table)
+        for row in rows:
+            values = dict(zip(columns, row))
+            discord_id = self.usernames.get(values["tetrio_username"])
+            if discord_id is None:
+                continue
+            if values.get("discord_id", discord_id) != discord_id:
+                self.invalidate(discord_id)
+                continue
+
+            _, profile = self.entries[discord_id]
+            profile.update(values)
+            self.entries[discord_id] = (time.monotonic() + self.ttl, profile)
+
+profile_cache = ProfileCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+async def get_profile(discord_id: Optional[str] = None, username: Optional[str] = None):
+    profile = profile_cache.get(discord_id=discord_id, username=username)
+    if profile is not None:
+        return profile
+
+    column, key = ("u.discord_id", discord_id) if discord_id is not None else ("u.tetrio_username", username)
+    async with connect_db(readonly=True) as db:
+        async with db.execute(f'''
+                              SELECT u.discord_id, u.tetrio_username, u.ar, u.country,
+                                     tl.rd, tl.tr, tl.rank, tl.best_rank, tl.apm, tl.pps, tl.vs
+                              FROM users u
+                              LEFT JOIN tl ON tl.tetrio_username = u.tetrio_username
+                              WHERE {column} = ?
+                              ''', (key,)) as c:
+            row = await c.fetchone()
+
+    if row is None or row["tetrio_username"] in ("null", None):
+        return None
+
+    profile = dict(row)
+    profile_cache.put(profile)
+    return profile
+
+role_limiter = TokenBucket(rate=ROLE_EDIT_RATE, capacity=ROLE_EDIT_BURST)
+
+def rank_roles(guild: discord.Guild):
+    roles = role_cache.get(guild.id)
+    if roles is None:
+        names = set(rank_to_role.values())
+        roles = {role.name: role for role in guild.roles if role.name in names}
+        role_cache[guild.id] = roles
+        if len(roles) < len(names):
+            logging.warning(f"Guild {guild.id} is missing rank roles: {', '.join(sorted(names - set(roles)))}")
+    return roles
+
+async def apply_rank_role(member: discord.Member, rank: str):
+    roles = rank_roles(member.guild)
+    desired = roles.get(rank_to_role.get(rank))
+    if desired is None:
+        return False
+
+    #only touch rank roles, so changes to other roles made since the member was cached are never reverted
+    stale = [role for role in member.roles if role.name in roles and role != desired]
+    missing = desired not in member.roles
+    if not stale and not missing:
+        return False
+
+    reason = f"TETR.IO rank {rank}"
+    if stale:
+        await role_limiter.acquire()
+        await member.remove_roles(*stale, reason=reason)
+    if missing:
+        await role_limiter.acquire()
+        await member.add_roles(desired, reason=reason)
+    return True
+
+async def role_sync_worker():
+    while True:
+        discord_id, username, rank = await role_queue.get()
+        try:
+            if discord_id is None:
+                profile = await get_profile(username=username)
+                if profile is None:
+                    continue
+                discord_id = profile["discord_id"]
+
+            if synced_ranks.get(discord_id) == rank:
+                continue
+
+            for guild_id in ALLOWED_GUILD:
+                guild = bot.get_guild(guild_id)
+                member = guild.get_member(int(discord_id)) if guild else None
+                if member and await apply_rank_role(member, rank):
+                    logging.info(f"Set rank role {rank_to_role[rank]} for {username} in guild {guild_id}")
+
+            synced_ranks[discord_id] = rank
+        except discord.Forbidden as e:
+            logging.error(f"[role_sync] Missing permission to edit roles of {username}: {e}")
+        except Exception as e:
+            logging.error(f"[role_sync] Failed for {username}: {type(e).__name__}: {e}")
+        finally:
+            role_queue.task_done()
+
+async def sync_all_roles():
+    async with connect_db(readonly=True) as db:
+        async with db.execute('''
+                              SELECT u.discord_id, tl.tetrio_username, tl.rank
+                              FROM tl
+                              JOIN users u ON u.tetrio_username = tl.tetrio_username
+                              ''') as c:
+            async for row in c:
+                if synced_ranks.get(row[0]) != row[2]:
+                    role_queue.put_nowait((row[0], row[1], row[2]))
+
+def after_write(written: dict):
+    for table, rows in written.items():
+        profile_cache.write(table, rows)
+
+    for row in written.get("tl", []):
+        tl = dict(zip(table_columns("tl"), row))
+        if tl["rank"] in rank_to_role:
+            role_queue.put_nowait((None, tl["tetrio_username"], tl["rank"]))
+
+class ChangeEvent(NamedTuple):
+    kind: str #"rank" or a leaderboards category
+    username: str
+    old: object
+    new: object
+
+class TournamentEvent(NamedTuple):
+    kind: str #"regis_open", "regis_close" or "start"
+    tour_id: str
+    name: str
+    ts: int
+
+pb_categories = ("40l", "blitz", "zenith")
+
+async def change_events(db, written: dict):
+    events = []
+    watched = [("rank", "tl", "rank", None), *((category, *leaderboards[category][:3]) for category in pb_categories)]
+    for kind, table, column, order in watched:
+        rows = written.get(table)
+        if not rows:
+            continue
+
+        index = table_columns(table).index(column)
+        new = {row[0]: row[index] for row in rows}
+        #only tables whose fingerprint changed get here, so this read is rare
+        async with db.execute(f'''
+                              SELECT tetrio_username, "{column}" FROM "{table}"
+                              WHERE tetrio_username IN ({", ".join("?" * len(new))})
+                              ''', tuple(new)) as c:
+            old = {row[0]: row[1] async for row in c}
+
+        for username, value in new.items():
+            if username not in old or old[username] == value:
+                continue
+            before = old[username]
+            if kind == "rank":
+                if before not in rank_to_role or value not in rank_to_role:
+                    continue
+            elif not value or value <= 0:
+                continue
+            elif before and before > 0 and (value > before if order == "ASC" else value < before):
+                continue
+            events.append(ChangeEvent(kind, username, before, value))
+
+    return events
+
+def announce(events: list):
+    for event in events:
+        try:
+            announce_queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logging.warning(f"Announcement queue full, dropped {event.kind} event for {event.username}")
+
+def format_event(event):
+    if isinstance(event, TournamentEvent):
+        if event.kind == "regis_open":
+            return f"Registration for **{event.name}** (`{event.tour_id}`) is now open! Use `-rt {event.tour_id}` to join."
+        if event.kind == "regis_close":
+            return f"Registration for **{event.name}** (`{event.tour_id}`) is now closed."
+        return f"**{event.name}** (`{event.tour_id}`) is starting now!"
+    if event.kind == "rank":
+        return f"**{event.username}**: {rank_to_role[event.old]} → {rank_to_role[event.new]}"
+    title = leaderboards[event.kind][3]
+    if event.old and event.old > 0:
+        return f"**{event.username}**: new {title} PB {format_score(event.kind, event.new)} (was {format_score(event.kind, event.old)})"
+    return f"**{event.username}**: first {title} record {format_score(event.kind, event.new)}"
+
+def announcement_messages(events: list):
+    #a player who changes several times within one interval only gets one line per kind
+    merged = {}
+    for event in events:
+        key = event
+        if isinstance(event, ChangeEvent):
+            key = (event.kind, event.username)
+            first = merged.get(key, event)
+            event = ChangeEvent(event.kind, event.username, first.old, event.new)
+        merged[key] = event
+
+    messages, lines = [], []
+    for event in merged.values():
+        if event.kind == "rank" and event.old == event.new:
+            continue
+        line = format_event(event)
+        if lines and len("\n".join([*lines, line])) > 2000:
+            messages.append("\n".join(lines))
+            lines = []
+        lines.append(line)
+    if lines:
+        messages.append("\n".join(lines))
+    return messages
+
+async def announcement_worker():
+    while True:
+        events = [await announce_queue.get()]
+        #player changes are batched until the deadline, a tournament deadline flushes the batch right away
+        deadline = time.monotonic() + ANNOUNCE_INTERVAL
+        while not isinstance(events[-1], TournamentEvent):
+            try:
+                events.append(await asyncio.wait_for(announce_queue.get(), deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+        while not announce_queue.empty():
+            events.append(announce_queue.get_nowait())
+
+        messages = announcement_messages(events)
+        for channel_id in ANNOUNCE_CHANNELS:
+            channel = bot.get_channel(channel_id)
+            if channel is None:
+                continue
+            for message in messages:
+                try:
+                    await channel.send(message)
+                except discord.HTTPException as e:
+                    logging.error(f"[announce] Failed to send to channel {channel_id}: {type(e).__name__}: {e}")
+        logging.info(f"Announced {len(events)} events in {len(messages)} messages")
+
+class TournamentScheduler:
+    def __init__(self):
+        self.heap = []
+        self.wakeup = asyncio.Event()
+
+    async def load(self):
+        now = int(time.time())
+        async with connect_db(readonly=True) as db:
+            async with db.execute('''
+                                  SELECT 'regis_open', id, name, regis_start FROM tournament WHERE regis_start > ?
+                                  UNION ALL
+                                  SELECT 'regis_close', id, name, regis_end FROM tournament WHERE regis_end > ?
+                                  UNION ALL
+                                  SELECT 'start', id, name, date FROM tournament WHERE date > ?
+                                  ''', (now, now, now)) as c:
+                self.heap = [(row[3], TournamentEvent(*row)) for row in await c.fetchall()]
+        heapq.heapify(self.heap)
+        self.wakeup.set()
+        logging.info(f"Scheduled {len(self.heap)} tournament deadlines")
+
+    def add(self, tour_id: str, name: str, regis_start: int, regis_end: int, date: int):
+        now = int(time.time())
+        for kind, ts in (("regis_open", regis_start), ("regis_close", regis_end), ("start", date)):
+            if ts > now:
+                heapq.heappush(self.heap, (ts, TournamentEvent(kind, tour_id, name, ts)))
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = time.time()
+            due = []
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap)[1])
+            announce(due)
+
+            timeout = self.heap[0][0] - now if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+tournament_scheduler = TournamentScheduler()
+
+rank_order = {rank: i for i, rank in enumerate(rank_to_role)}
+
+def rank_eligible(rank: Optional[str], min_rank: Optional[str], max_rank: Optional[str]):
+    index = rank_order.get(rank, -1)
+    return rank_order.get(min_rank, 0) <= index <= rank_order.get(max_rank, len(rank_order) - 1)
+
+async def seeding_rows(tour_id: str):
+    async with connect_db(readonly=True) as db:
+        async with db.execute("SELECT * FROM tournament WHERE id = ?", (tour_id,)) as c:
+            tour_row = await c.fetchone()
+        if tour_row is None:
+            return None, []
+
+        async with db.execute('''
+                              SELECT r.tetrio_username, u.discord_id, tl.rank, tl.tr, tl.rd
+                              FROM tournament_regis r
+                              LEFT JOIN users u ON u.tetrio_username = r.tetrio_username
+                              LEFT JOIN tl ON tl.tetrio_username = r.tetrio_username
+                              WHERE r.id = ?
+                              ORDER BY tl.tr DESC, r.tetrio_username
+                              ''', (tour_id,)) as c:
+            rows = await c.fetchall()
+
+    entrants = []
+    for row in rows:
+        if row["rank"] is None:
+            status = "no rank data"
+        elif not rank_eligible(row["rank"], tour_row["min_rank"], tour_row["max_rank"]):
+            status = "rank out of range"
+        else:
+            status = "ok"
+        entrants.append((row["tetrio_username"], row["discord_id"], row["rank"], row["tr"], row["rd"], status))
+
+    #eligible players keep their TR order at the top, the rest follow without a seed
+    entrants.sort(key=lambda entrant: entrant[5] != "ok")
+    return tour_row, entrants
 
 async def mod_check(ctx: commands.Context):
 
@@ -274,7 +1221,44 @@ def unix_parser(date_str: str, time_format: str = "HH:MM dd/mm/yy", tz_offset: i
         logging.error(f"[unix_parser] Failed to parse '{date_str}' with format '{time_format}': {type(e).__name__}: {e}")
         raise ValueError(f"Invalid date/time format: '{date_str}'. Expected format: {fmt}") from e
 
-async def api_request(url: str, retries=3):
+def revalidated_until(headers):
+    ttl = API_CACHE_REVALIDATE_TTL
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name.lower() == "max-age" and value.isdigit():
+            ttl = int(value)
+    return int((time.time() + ttl) * 1000)
+
+def retry_delay(after: Optional[str], attempt: int):
+    if after:
+        try:
+            return max(float(after), 0)
+        except ValueError:
+            pass
+        try:
+            return max((parsedate_to_datetime(after) - datetime.now(timezone.utc)).total_seconds(), 0)
+        except (TypeError, ValueError):
+            pass
+    return 2 ** attempt + random.random()
+
+async def api_request(url: str, retries=3, cache: bool = True):
+    cached = response_cache.get(url) if cache else None
+    if cached is not None:
+        api_cache_lookups.inc("hit")
+        return cached
+
+    task = inflight_requests.get(url)
+    if task is None:
+        api_cache_lookups.inc("miss")
+        task = asyncio.ensure_future(fetch_api(url, retries, cache))
+        inflight_requests[url] = task
+        task.add_done_callback(lambda _: inflight_requests.pop(url, None))
+    else:
+        api_cache_lookups.inc("coalesced")
+
+    return await asyncio.shield(task)
+
+async def fetch_api(url: str, retries=3, cache: bool = True):
     global session
 
     if session is None:
@@ -286,62 +1270,177 @@ async def api_request(url: str, retries=3):
         "X-Session-ID": str(uuid.uuid4()),
     }
 
+    stale = response_cache.stale(url) if cache else None
+    if stale and stale[1]:
+        headers["If-None-Match"] = stale[1]
+
+    endpoint = endpoint_name(url)
     for attempt in range(retries):
+        if not api_breaker.allow():
+            api_responses.inc(endpoint, "circuit_open")
+            logging.debug(f"Circuit open, skipping {url}")
+            return None
+
+        probe = api_breaker.probing
+        await api_limiter.acquire()
+        started = time.perf_counter()
         try:
             async with session.get(url, headers=headers) as r:
+                api_latency.observe(time.perf_counter() - started, endpoint)
+                api_responses.inc(endpoint, str(r.status))
+                limited = api_limiter.observe(r.headers)
+
                 if r.status == 429:
-                    after = r.headers.get("Retry-After")
-                    delay = float(after) if after else 2 ** attempt + random.random()
-                    logging.warning(f"Rate limited on attempt {attempt + 1} ({url}), retrying in {delay:.2f}s...")
-                    await asyncio.sleep(delay)
+                    api_retries.inc(endpoint, "429")
+                    delay = retry_delay(r.headers.get("Retry-After"), attempt)
+                    api_limiter.throttle(delay)
+                    logging.warning(f"Rate limited on attempt {attempt + 1} ({url}), pausing all requests for {delay:.2f}s...")
+                    continue
+
+                if r.status >= 500:
+                    api_retries.inc(endpoint, "5xx")
+                    api_breaker.failure()
+                    logging.error(f"HTTP {r.status} for {url}")
+                    await asyncio.sleep(2 ** attempt + random.random())
                     continue
 
+                api_breaker.success()
+                if not limited:
+                    api_limiter.recover()
+
+                if r.status == 304 and stale:
+                    await response_cache.refresh(url, revalidated_until(r.headers))
+                    return stale[2]
+
                 if r.status == 200:
-                    data: dict = await r.json()
+                    data: dict = decode_response(url, await r.read())
                     if data.get("success"):
+                        if cache:
+                            await response_cache.put(url, data, r.headers.get("ETag"))
                         return data
                 else:
                     logging.error(f"HTTP {r.status} for {url}")
                     break
 
-        except aiohttp.ClientError as e:
-            logging.error(f"Network error ({url}): {e}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            api_retries.inc(endpoint, "network")
+            api_breaker.failure()
+            logging.error(f"Network error ({url}): {type(e).__name__}: {e}")
             await asyncio.sleep(2 ** attempt + random.random())
+        finally:
+            if probe:
+                api_breaker.abandon()
 
     return None
 
-async def get_counter(key: str):
-    async with connect_db() as db:
-        c = await db.execute("SELECT value FROM counters WHERE key = ?", (key,))
-        row = await c.fetchone()
-        return row[0] if row else 0
-        
-async def tour_id_gen(timestamp: int):
+async def tour_id_gen(db, timestamp: int):
     date = datetime.fromtimestamp(timestamp)
     yy = date.year % 100
     m = date.strftime("%b")[0].upper()
     year = date.year
-    ii = await get_counter(f"{year}_tournament") + 1
 
-    await update_counter(key=f"{year}_tournament", amount=1, timestamp=int(time.time()))
+    #increment and read back in one statement on the caller's writer, so the id commits or rolls back with the tournament
+    async with db.execute('''
+                          INSERT INTO counters(key, value, last_update, message)
+                          VALUES              (?  , 1    , ?          , ''     )
+                          ON CONFLICT(key) DO UPDATE SET
+                              value = value + 1,
+                              last_update = excluded.last_update
+                          RETURNING value
+                          ''', (f"{year}_tournament", int(time.time()))) as c:
+        ii = (await c.fetchone())[0]
 
     return f"{yy:02d}{m}{ii:02d}"
 
-async def update_counter(key: str, amount: int = 1, timestamp: int = 0, message: str = ''):
-    if timestamp == 0:
-        timestamp = int(time.time())
-    async with connect_db() as db:
-        await db.execute('''
-                         INSERT INTO counters(key, value, last_update, message)
-                         VALUES              (?  , ?    , ?          , ?      )
-                         ON CONFLICT(key) DO UPDATE SET
-                             value = value + ?,
-                             last_update = excluded.last_update,
-                             message = excluded.message
-                         ''', (key, amount, timestamp, message, amount)
-                         )
-        
-        await db.commit()
+async def load_search_misses():
+    async with connect_db(readonly=True) as db:
+        async with db.execute("SELECT discord_id, failures, expires FROM search_misses") as c:
+            search_misses.update({row[0]: (row[1], row[2]) async for row in c})
+
+def search_blocked(discord_id: str):
+    entry = search_misses.get(discord_id)
+    return entry is not None and entry[1] > time.time()
+
+def record_miss(discord_id: str):
+    failures = search_misses.get(discord_id, (0, 0))[0] + 1
+    expires = int(time.time()) + min(SEARCH_MISS_TTL * 2 ** (failures - 1), SEARCH_MISS_MAX_TTL)
+    search_misses[discord_id] = (failures, expires)
+    return (discord_id, failures, expires)
+
+async def search_username(discord_id: str):
+    rsp = await api_request(url=SEARCH_URL.format(discord_id))
+    if rsp is None:
+        return None
+
+    users = rsp.get("data", {}).get("users", [])
+    return users[0]["username"] if users else "null"
+
+async def discover_members(guild: discord.Guild):
+    key = f"discovery_cursor_{guild.id}"
+
+    async with connect_db(readonly=True) as db:
+        async with db.execute("SELECT discord_id FROM users") as c:
+            known = {row[0] async for row in c}
+        async with db.execute("SELECT value FROM counters WHERE key = ?", (key,)) as c:
+            row = await c.fetchone()
+
+    after = discord.Object(id=row[0]) if row and row[0] else None
+    if after:
+        logging.info(f"Resuming member discovery for guild {guild.id} after {after.id}")
+
+    found, misses = [], []
+
+    async def search(member: discord.Member):
+        username = await search_username(str(member.id))
+        if username is None:
+            return
+
+        if username == "null":
+            misses.append(record_miss(str(member.id)))
+            return
+
+        search_misses.pop(str(member.id), None)
+        found.append((str(member.id), username, 0, "null"))
+
+    async def save(chunk: list, cursor: Optional[int]):
+        await run_pool(chunk, search)
+
+        async with connect_db() as db:
+            await db.executemany('''
+                                 INSERT OR IGNORE INTO users(discord_id, tetrio_username, ar, country)
+                                 VALUES (?, ?, ?, ?)
+                                 ''', found)
+            await db.executemany("DELETE FROM search_misses WHERE discord_id = ?", [(user[0],) for user in found])
+            await db.executemany("INSERT OR REPLACE INTO search_misses(discord_id, failures, expires) VALUES (?, ?, ?)", misses)
+            if cursor is None:
+                await db.execute("DELETE FROM counters WHERE key = ?", (key,))
+            else:
+                await db.execute('''
+                                 INSERT INTO counters(key, value, last_update, message)
+                                 VALUES              (?  , ?    , ?          , ?      )
+                                 ON CONFLICT(key) DO UPDATE SET
+                                     value = excluded.value,
+                                     last_update = excluded.last_update
+                                 ''', (key, cursor, int(time.time()), "")
+                                 )
+            await db.commit()
+
+        known.update(user[0] for user in found)
+        found.clear()
+        misses.clear()
+
+    chunk, scanned = [], 0
+    async for member in guild.fetch_members(limit=None, after=after):
+        scanned += 1
+        if str(member.id) not in known and not search_blocked(str(member.id)):
+            chunk.append(member)
+
+        if scanned % DISCOVERY_CHUNK == 0:
+            await save(chunk, member.id)
+            chunk = []
+
+    await save(chunk, None)
+    logging.info(f"Member discovery for guild {guild.id} done, scanned {scanned} members")
 
 async def on_start():
     for guild_id in ALLOWED_GUILD:
@@ -354,30 +1453,75 @@ async def on_start():
 
         guild = bot.get_guild(guild_id)
         if guild:
-            async with connect_db() as db:
-                async for member in guild.fetch_members(limit=None):
-                    if member.id in temp_bl:
-                        continue
-
-                    async with db.execute("SELECT 1 FROM users WHERE discord_id = ?", (str(member.id),)) as c:
-                        exist = await c.fetchone()
-                        if exist:
-                            continue
-
-                        rsp = await api_request(url=SEARCH_URL.format(member.id))
-                        users = rsp.get("data", {}).get("users", []) if rsp else []
-                        username = users[0]["username"] if users else "null"
+            await discover_members(guild)
+
+@functools.cache
+def table_columns(table: str):
+    if table == "users":
+        return ("discord_id", "tetrio_username", *tables["users"])
+    if table == "tl_past":
+        return ("tetrio_username", "season", "rd", "tr", "rank", "best_rank", "apm", "pps", "vs")
+    if table == "zen":
+        return ("tetrio_username", "xp")
+    if table == "fingerprints":
+        return ("tetrio_username", "tbl", "hash")
+    if table == "refresh_schedule":
+        return ("tetrio_username", "next_refresh", "refresh_interval", "last_change", "last_refresh")
+    if table == "tl_history":
+        return ("tetrio_username", "ts", "tr", "rank", "apm", "pps", "vs")
+    return ("tetrio_username", *tables[table])
+
+@functools.cache
+def upsert_sql(table: str):
+    columns = table_columns(table)
+    return f'INSERT OR REPLACE INTO "{table}" ({", ".join(columns)}) VALUES ({", ".join(["?"] * len(columns))})'
+
+def extract_rows(username: str, discord_id: Optional[str], rsp: dict):
+    return summary_plan.rows(username, discord_id, rsp)
+
+def fingerprint(rows: list):
+    return hashlib.blake2b(repr(rows).encode(), digest_size=8).hexdigest()
+
+def changed_rows(username: str, rows: dict, pending: Optional[dict] = None):
+    pending = pending or {}
+    changed, hashes = {}, {}
+    for table, values in rows.items():
+        digest = fingerprint(values)
+        key = (username, table)
+        if pending.get(key, fingerprints.get(key)) != digest:
+            changed[table] = values
+            hashes[key] = digest
+
+    if changed.get("tl"):
+        tl = dict(zip(table_columns("tl"), changed["tl"][0]))
+        sample = (tl["tr"], tl["rank"], tl["apm"], tl["pps"], tl["vs"])
+        digest = fingerprint([sample])
+        key = (username, "tl_history")
+        if pending.get(key, fingerprints.get(key)) != digest:
+            changed["tl_history"] = [(username, int(time.time()), *sample)]
+            hashes[key] = digest
+
+    return changed, hashes
+
+async def load_fingerprints():
+    async with connect_db(readonly=True) as db:
+        async with db.execute("SELECT tetrio_username, tbl, hash FROM fingerprints") as c:
+            fingerprints.update({(row[0], row[1]): row[2] async for row in c})
+    logging.info(f"Loaded {len(fingerprints)} fingerprints")
+
+def schedule_row(username: str, last_change: int, now: int, failed: bool = False, previous: Optional[int] = None):
+    if failed:
+        #back off on repeated failures so deleted or banned accounts stop costing a request every few minutes
+        interval = min(max((previous or 0) * 2, REFRESH_MIN_INTERVAL), REFRESH_MAX_INTERVAL)
+    else:
+        interval = min(max((now - last_change) // 4, REFRESH_MIN_INTERVAL), REFRESH_MAX_INTERVAL)
+    return (username, now + interval, interval, last_change, now)
 
-                        if not username or username == "null":
-                            temp_bl.add(member.id)
-                            continue
-                        
-                        await db.execute('''
-                                         INSERT OR IGNORE INTO users(discord_id, tetrio_username, ar, country)
-                                         VALUES (?, ?, ?, ?)
-                                         ''', (str(member.id), username, 0, "null"))
-                
-                await db.commit()
+async def boost_refresh(username: str):
+    #0 sorts ahead of every overdue user, so the next pass picks this one up even under a backlog
+    async with connect_db() as db:
+        await db.execute("UPDATE refresh_schedule SET next_refresh = 0 WHERE tetrio_username = ?", (username,))
+        await db.commit()
 
 async def db_update(db
                     ,username: Optional[str] = None
@@ -386,18 +1530,223 @@ async def db_update(db
                     ):
     if rsp is None:
         return
-    
-    for table, fields in tables.items():
-        if callable(fields):
-            value = fields(rsp)
-
-            if table == "tl_past" and isinstance(value, dict):
-                for season, data in value.items():
-                    await db.execute(f'''
-                        INSERT OR REPLACE INTO "{table}" 
-                        (tetrio_username, season, rd, tr, rank, best_rank, apm, pps, vs)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
+
+    #the caller commits, then passes the result to after_commit so nothing in memory runs ahead of the database
+    changed, hashes = changed_rows(username, extract_rows(username, discord_id, rsp))
+    events = await change_events(db, changed)
+    for table, rows in changed.items():
+        if rows:
+            started = time.perf_counter()
+            await db.executemany(upsert_sql(table), rows)
+            db_write_time.observe(time.perf_counter() - started, table)
+
+    if hashes:
+        await db.executemany(upsert_sql("fingerprints"), [(*key, digest) for key, digest in hashes.items()])
+
+    return changed, hashes, events
+
+def after_commit(changed: dict, hashes: dict, events: list):
+    fingerprints.update(hashes)
+    after_write(changed)
+    announce(events)
+
+class BatchWriter:
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, flush_interval: float = WRITE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = self.empty()
+        self.hashes = {}
+        self.count = 0
+        self.skipped = 0
+        self.last_flush = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def empty():
+        return {table: [] for table in [*tables, "tl_history", "fingerprints", "refresh_schedule"]}
+
+    async def add(self, username: str, discord_id: Optional[str], rsp: dict):
+        return await self.add_rows(username, extract_rows(username, discord_id, rsp))
+
+    async def add_rows(self, username: str, rows: dict):
+        changed, hashes = changed_rows(username, rows, self.hashes)
+        if changed:
+            for table, rows in changed.items():
+                self.pending[table].extend(rows)
+            self.pending["fingerprints"].extend((*key, digest) for key, digest in hashes.items())
+            self.hashes.update(hashes)
+            self.count += 1
+        else:
+            self.skipped += 1
+
+        if self.count >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            await self.flush()
+
+        return set(changed)
+
+    def reschedule(self, username: str, last_change: int, failed: bool = False, previous: Optional[int] = None):
+        self.pending["refresh_schedule"].append(schedule_row(username, last_change, int(time.time()), failed, previous))
+
+    async def flush(self):
+        async with self.lock:
+            pending, hashes, count, skipped = self.pending, self.hashes, self.count, self.skipped
+            self.pending = self.empty()
+            self.hashes = {}
+            self.count = 0
+            self.skipped = 0
+            self.last_flush = time.monotonic()
+
+            if not any(pending.values()):
+                return
+
+            try:
+                async with connect_db() as db:
+                    events = await change_events(db, pending)
+                    for table, rows in pending.items():
+                        if rows:
+                            started = time.perf_counter()
+                            await db.executemany(upsert_sql(table), rows)
+                            db_write_time.observe(time.perf_counter() - started, table)
+                    started = time.perf_counter()
+                    await db.commit()
+                    db_write_time.observe(time.perf_counter() - started, "commit")
+            except Exception as e:
+                logging.error(f"[BatchWriter] Failed to write {count} summaries: {type(e).__name__}: {e}")
+                return
+
+            after_commit(pending, hashes, events)
+            logging.info(f"Wrote {count} summaries ({sum(len(rows) for rows in pending.values())} rows), {skipped} unchanged")
+
+def league_rows(username: str, entry: dict):
+    return league_plan.rows(username, None, {"data": {"league": entry.get("league")}})["tl"]
+
+async def fetch_league(players: dict):
+    found = {}
+    remaining = sorted(players.items(), key=lambda player: player[1], reverse=True)
+    after = None
+    window = 0
+    pages = 0
+
+    while remaining and pages < BULK_MAX_PAGES:
+        if after is None:
+            #league prisecters lead with TR, so a window can start just above the next player we are looking for
+            after = f"{remaining[0][1] + BULK_TR_MARGIN}:0:0"
+
+        #window keys change every sweep, so caching these pages would only evict player responses
+        rsp = await api_request(LEAGUE_URL.format(after), cache=False)
+        pages += 1
+        window += 1
+        entries = safe_get(rsp, "data", "entries", default=[])
+        if not entries:
+            break
+
+        for entry in entries:
+            if entry.get("username") in players:
+                found[entry["username"]] = entry
+
+        #anyone left above this page has moved since their last refresh and falls back to summaries
+        floor = safe_get(entries[-1], "league", "tr", default=0)
+        remaining = [(name, tr) for name, tr in remaining if name not in found and tr <= floor + BULK_TR_MARGIN]
+        if remaining and window >= BULK_WINDOW_PAGES:
+            #the next player never showed up within a window, leave them to summaries instead of restarting
+            remaining.pop(0)
+            window = 0
+        if not remaining:
+            break
+
+        if remaining[0][1] + BULK_TR_MARGIN < floor:
+            #the next player is further down than the window margin, so jump instead of paging there
+            after = None
+            window = 0
+        else:
+            p = entries[-1].get("p", {})
+            after = f"{p.get('pri')}:{p.get('sec')}:{p.get('ter')}"
+
+    return found
+
+def rollup_sql(source: str, target: str):
+    if source == "tl_history":
+        source = "SELECT tetrio_username, ts, tr AS tr_min, tr AS tr_max, tr, rank, apm, pps, vs, 1 AS samples FROM tl_history"
+    return f'''
+        INSERT OR REPLACE INTO {target}(tetrio_username, ts, tr_min, tr_max, tr, rank, apm, pps, vs, samples)
+        SELECT tetrio_username, bucket, MIN(tr_min), MAX(tr_max), last_tr, last_rank,
+               SUM(apm * samples) / SUM(samples), SUM(pps * samples) / SUM(samples), SUM(vs * samples) / SUM(samples),
+               SUM(samples)
+        FROM (
+            SELECT *, ts / :bucket * :bucket AS bucket,
+                   LAST_VALUE(tr) OVER w AS last_tr,
+                   LAST_VALUE(rank) OVER w AS last_rank
+            FROM ({source})
+            WHERE ts < :cutoff
+            WINDOW w AS (PARTITION BY tetrio_username, ts / :bucket ORDER BY ts
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+        )
+        GROUP BY tetrio_username, bucket
+    '''
+
+async def compact_history(now: Optional[int] = None):
+    now = now or int(time.time())
+    stages = [
+        ("tl_history", "tl_history_hourly", 60 * 60, HISTORY_RAW_RETENTION),
+        ("tl_history_hourly", "tl_history_daily", 24 * 60 * 60, HISTORY_HOURLY_RETENTION),
+    ]
+
+    async with connect_db() as db:
+        for source, target, bucket, retention in stages:
+            cutoff = (now - retention) // bucket * bucket
+            await db.execute(rollup_sql(source, target), {"bucket": bucket, "cutoff": cutoff})
+            c = await db.execute(f"DELETE FROM {source} WHERE ts < ?", (cutoff,))
+            if c.rowcount:
+                logging.info(f"Rolled {c.rowcount} {source} points up into {target}")
+
+        await db.execute("DELETE FROM tl_history_daily WHERE ts < ?", (now - HISTORY_DAILY_RETENTION,))
+        await db.commit()
+
+class ExtractionPlan:
+    def __init__(self, schema: dict):
+        #every field path goes into one trie, so fields sharing a prefix walk it once per response
+        self.defaults = []
+        self.slices = {}
+        root = {}
+        for table, fields in schema.items():
+            if isinstance(fields, tuple):
+                fields = {table: fields}
+            start = len(self.defaults)
+            for path, default in fields.values():
+                node = root
+                for key in path[:-1]:
+                    node = node.setdefault(key, ({}, []))[0]
+                node.setdefault(path[-1], ({}, []))[1].append(len(self.defaults))
+                self.defaults.append(default)
+            self.slices[table] = (start, len(self.defaults))
+        self.root = self.freeze(root)
+
+    def freeze(self, node: dict):
+        return tuple((key, tuple(slots), self.freeze(children)) for key, (children, slots) in node.items())
+
+    def values(self, rsp: dict):
+        out = self.defaults.copy()
+        stack = [(self.root, rsp)] if isinstance(rsp, dict) else []
+        while stack:
+            node, d = stack.pop()
+            for key, slots, children in node:
+                value = d.get(key)
+                if value is None:
+                    continue
+                for slot in slots:
+                    out[slot] = value
+                if children and isinstance(value, dict):
+                    stack.append((children, value))
+        return out
+
+    def rows(self, username: str, discord_id: Optional[str], rsp: dict):
+        values = self.values(rsp)
+        rows = {}
+        for table, (start, end) in self.slices.items():
+            if table == "tl_past":
+                past = values[start]
+                if isinstance(past, dict):
+                    rows[table] = [(
                         username,
                         season,
                         data.get("rd", -1),
@@ -407,34 +1756,74 @@ async def db_update(db
                         data.get("apm", -1),
                         data.get("pps", -1),
                         data.get("vs", -1)
-                    ))
-
-            elif table == "zen":  
-                await db.execute("""
-                    INSERT OR REPLACE INTO zen (tetrio_username, xp)
-                    VALUES (?, ?)
-                """, (username, value))
-
-        elif table == "users":
-            if discord_id is None:
-                continue
-
-            values = {field: extractor(rsp) for field, extractor in fields.items()}
-            columns = ", ".join(["discord_id", "tetrio_username"] + list(values.keys()))
-            placeholders = ", ".join(["?"] * (2 + len(values)))
-            await db.execute(
-                f'INSERT OR REPLACE INTO "{table}" ({columns}) VALUES ({placeholders})',
-                (str(discord_id), username, *values.values())
-            )
+                    ) for season, data in past.items()]
 
-        else: 
-            values = {field: extractor(rsp) for field, extractor in fields.items()}
-            columns = ", ".join(["tetrio_username"] + list(values.keys()))
-            placeholders = ", ".join(["?"] * (len(values) + 1))
-            await db.execute(
-                f'INSERT OR REPLACE INTO "{table}" ({columns}) VALUES ({placeholders})',
-                (username, *values.values())
-            )
+            elif table == "users":
+                if discord_id is None:
+                    continue
+                rows[table] = [(str(discord_id), username, *values[start:end])]
+
+            else:
+                rows[table] = [(username, *values[start:end])]
+
+        return rows
+
+summary_plan = ExtractionPlan(tables)
+league_plan = ExtractionPlan({"tl": tables["tl"]})
+
+def json_loads(body):
+    return orjson.loads(body) if orjson else json.loads(body)
+
+def json_dumps(data):
+    return orjson.dumps(data).decode() if orjson else json.dumps(data)
+
+class SummaryDecoder:
+    def __init__(self, paths: list):
+        #only the keys on these paths survive decoding, the rest of a summaries payload is never kept
+        self.tree = {}
+        for path in paths:
+            node = self.tree
+            for key in path:
+                node = node.setdefault(key, {})
+        self.decoder = msgspec.json.Decoder(self.struct("Summary", self.tree)) if msgspec else None
+
+    def struct(self, name: str, node: dict):
+        fields, rename = [], {}
+        for i, (key, children) in enumerate(node.items()):
+            kind = self.struct(f"{name}_{i}", children) if children else object
+            fields.append((f"f{i}", Optional[kind], None))
+            rename[f"f{i}"] = key
+        return msgspec.defstruct(name, fields, rename=rename, omit_defaults=True)
+
+    def prune(self, d: dict, node: dict):
+        out = {}
+        for key, children in node.items():
+            value = d.get(key)
+            if children and isinstance(value, dict):
+                value = self.prune(value, children)
+            if value is not None:
+                out[key] = value
+        return out
+
+    def decode(self, body: bytes):
+        if self.decoder is not None:
+            try:
+                return msgspec.to_builtins(self.decoder.decode(body))
+            except msgspec.ValidationError:
+                pass #unexpected shape somewhere, fall back to the generic path
+        data = json_loads(body)
+        return self.prune(data, self.tree) if isinstance(data, dict) else data
+
+summary_decoder = SummaryDecoder([
+    ("success",),
+    ("cache", "cached_until"),
+    *(path for fields in tables.values() for path, _ in (fields.values() if isinstance(fields, dict) else [fields]))
+])
+
+def decode_response(url: str, body: bytes):
+    if url.endswith("/summaries"):
+        return summary_decoder.decode(body)
+    return json_loads(body)
 
 def safe_get(d, *keys, default=None):
     for k in keys:
@@ -443,26 +1832,161 @@ def safe_get(d, *keys, default=None):
         d = d[k]
     return d
 
-async def print_db(ctx: commands.Context):
-    async with connect_db() as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT name FROM sqlite_master WHERE type='table';") as cur:
-            tables = await cur.fetchall()
-            tables = [t[0] for t in tables]
-
-        for table in tables:
-            msg = f"\n--- Table: {table} ---"
-            async with db.execute(f'SELECT * FROM "{table}"') as cur:
-                rows = await cur.fetchall()
-                for row in rows:
-                    msg += f"\n{dict(row)}"
-
-                    if len(msg) > 1800:
-                        await ctx.send(f"```\n{msg}\n```")
-                        msg = ""
+async def export_db(fmt: str, out):
+    async with connect_db(readonly=True) as db:
+        if fmt == "sqlite":
+            with tempfile.TemporaryDirectory() as tmp:
+                target = sqlite3.connect(os.path.join(tmp, "snapshot.db"), check_same_thread=False)
+                try:
+                    await db.backup(target)
+                finally:
+                    target.close()
+                with open(os.path.join(tmp, "snapshot.db"), "rb") as src, gzip.open(out, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+            return
 
-            if msg:
-                await ctx.send(f"```\n{msg}\n```")
+        await db.execute("BEGIN")
+        try:
+            async with db.execute("SELECT name FROM sqlite_master WHERE type='table';") as cur:
+                table_names = [t[0] for t in await cur.fetchall()]
+
+            if fmt == "csv":
+                with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+                    for table in table_names:
+                        with zf.open(f"{table}.csv", "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+                            writer = csv.writer(f)
+                            async with db.execute(f'SELECT * FROM "{table}"') as cur:
+                                writer.writerow([column[0] for column in cur.description])
+                                while rows := await cur.fetchmany(DUMP_BATCH_SIZE):
+                                    writer.writerows(tuple(row) for row in rows)
+            else:
+                with gzip.open(out, "wt", encoding="utf-8") as f:
+                    for table in table_names:
+                        async with db.execute(f'SELECT * FROM "{table}"') as cur:
+                            while rows := await cur.fetchmany(DUMP_BATCH_SIZE):
+                                for row in rows:
+                                    f.write(json.dumps({"table": table, "row": dict(row)}) + "\n")
+        finally:
+            await db.rollback()
+
+async def leaderboard_page(category: str, cursor: Optional[tuple] = None, limit: int = LEADERBOARD_PAGE_SIZE):
+    table, column, order, _ = leaderboards[category]
+    op = ">" if order == "ASC" else "<"
+
+    sql = f'SELECT tetrio_username, {column} AS value FROM "{table}" WHERE {column} > 0'
+    params = []
+    if cursor is not None:
+        sql += f" AND ({column}, tetrio_username) {op} (?, ?)"
+        params += cursor
+    sql += f" ORDER BY {column} {order}, tetrio_username {order} LIMIT ?"
+    params.append(limit)
+
+    async with connect_db(readonly=True) as db:
+        async with db.execute(sql, params) as c:
+            return [(row["tetrio_username"], row["value"]) for row in await c.fetchall()]
+
+def format_score(category: str, value):
+    if category == "40l":
+        return f"{value / 1000:.3f}s"
+    if category in ("zenith", "zenithex"):
+        return f"{value:.1f}m"
+    if category == "tr":
+        return f"{value:.2f}"
+    return f"{value:,.0f}"
+
+async def tournament_page(cursor: Optional[tuple] = None, limit: int = TOURNAMENT_PAGE_SIZE):
+    sql = "SELECT id, name, date, regis_start, regis_end FROM tournament WHERE date >= ?"
+    params = [int(time.time())]
+    if cursor is not None:
+        sql += " AND (date, id) > (?, ?)"
+        params += cursor
+    sql += " ORDER BY date, id LIMIT ?"
+    params.append(limit)
+
+    async with connect_db(readonly=True) as db:
+        async with db.execute(sql, params) as c:
+            return await c.fetchall()
+
+class LeaderboardView(discord.ui.View):
+    def __init__(self, author_id: int, category: str):
+        super().__init__(timeout=120)
+        self.author_id = author_id
+        self.category = category
+        self.cursors = [None]
+        self.rows = []
+        self.message: Optional[discord.Message] = None
+
+    async def render(self):
+        rows = await leaderboard_page(self.category, self.cursors[-1], LEADERBOARD_PAGE_SIZE + 1)
+        self.rows = rows[:LEADERBOARD_PAGE_SIZE]
+        self.prev_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = len(rows) <= LEADERBOARD_PAGE_SIZE
+
+        title = leaderboards[self.category][3]
+        page = len(self.cursors)
+        if not self.rows:
+            return f"No {title} records yet."
+
+        start = (page - 1) * LEADERBOARD_PAGE_SIZE + 1
+        table = f"{'#':<4} | {'Player':<20} | {title}\n"
+        table += "-"*40 + "\n"
+        for i, (username, value) in enumerate(self.rows, start=start):
+            table += f"{i:<4} | {username:<20} | {format_score(self.category, value)}\n"
+
+        return f"**{title} leaderboard** (page {page})\n```\n{table}```"
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return interaction.user.id == self.author_id
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
+    @discord.ui.button(label="Prev", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.pop()
+        await interaction.response.edit_message(content=await self.render(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.append(self.next_cursor())
+        await interaction.response.edit_message(content=await self.render(), view=self)
+
+    def next_cursor(self):
+        username, value = self.rows[-1]
+        return (value, username)
+
+class TournamentView(LeaderboardView):
+    def __init__(self, author_id: int):
+        super().__init__(author_id, category=None)
+
+    async def render(self):
+        rows = await tournament_page(self.cursors[-1], TOURNAMENT_PAGE_SIZE + 1)
+        self.rows = rows[:TOURNAMENT_PAGE_SIZE]
+        self.prev_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = len(rows) <= TOURNAMENT_PAGE_SIZE
+
+        if not self.rows:
+            return "No upcoming tournaments."
+
+        now = int(time.time())
+        table = f"{'ID':<6} | {'Name':<30} | {'Date':<18} | Registration open\n"
+        table += "-"*82 + "\n"
+        for row in self.rows:
+            reg_open = "Yes" if row["regis_start"] <= now <= row["regis_end"] else "No"
+            date_str = f"<t:{row['date']}:F>"
+            table += f"{row['id']:<6} | {row['name']:<30} | {date_str:<18} | {reg_open}\n"
+
+        table += "\nUse `-ti <ID>` to view full info."
+        return f"**Upcoming tournaments** (page {len(self.cursors)})\n```\n{table}\n```"
+
+    def next_cursor(self):
+        return (self.rows[-1]["date"], self.rows[-1]["id"])
 
 #=============== commands ===============#
 @bot.hybrid_command(name="help", 
@@ -498,15 +2022,28 @@ async def help_command(ctx: commands.Context, command_name: Optional[str] = None
 
 @bot.hybrid_command(name='leaderboard', 
                     description='Show the top players in the server',
-                    aliases=['lb'])
+                    aliases=['lb'],
+                    help='''Show the top players in the server
+Aliases: lb
+
+**Usage:**
+`-lb [category]`
+
+**Parameters**
+- `[category]`: One of `tr`, `40l`, `blitz`, `zenith`, `zenithex`, `zen` (default: tr)
+''')
 @app_commands.guilds(
     *[discord.Object(id=guild_id) for guild_id in ALLOWED_GUILD]
 )
-async def leaderboard(ctx: commands.Context):
-    msg = '''
-The command is currently under development.
-'''
-    await ctx.send(msg)
+@app_commands.describe(category="tr, 40l, blitz, zenith, zenithex or zen (default: tr)")
+async def leaderboard(ctx: commands.Context, category: str = "tr"):
+    category = category.lower()
+    if category not in leaderboards:
+        await ctx.send(f"Unknown category `{category}`. Available: {', '.join(leaderboards.keys())}")
+        return
+
+    view = LeaderboardView(author_id=ctx.author.id, category=category)
+    view.message = await ctx.send(await view.render(), view=view)
 
 
 @bot.hybrid_command(name='tournament_info', 
@@ -519,17 +2056,17 @@ Aliases: ti
 `-ti [tour_id]`
 
 **Parameters**
-- `[tour_id]`: The ID of the tournament
+- `[tour_id]`: The ID of the tournament. Leave empty to page through upcoming tournaments
 ''')
 @app_commands.guilds(
     *[discord.Object(id=guild_id) for guild_id in ALLOWED_GUILD]
 )
-async def tournament_info(ctx: commands.Context, tour_id: Optional[int]):
+async def tournament_info(ctx: commands.Context, tour_id: Optional[str]):
     if hasattr(ctx, "interaction") and ctx.interaction:
         await ctx.defer()
         
-    async with connect_db() as db:
-        if tour_id is not None:
+    if tour_id is not None:
+        async with connect_db(readonly=True) as db:
             async with db.execute("SELECT * FROM tournament WHERE id = ?", (tour_id,)) as cursor:
                 row = await cursor.fetchone()
                 if not row:
@@ -546,26 +2083,10 @@ async def tournament_info(ctx: commands.Context, tour_id: Optional[int]):
                     f"**Winner:** {row['winner']}\n"
                 )
                 await ctx.send(f"```\n{info}\n```")
-        else:
-            async with db.execute("SELECT id, name, date, regis_start, regis_end FROM tournament") as cursor:
-                rows = await cursor.fetchall()
-                
-                if not rows:
-                    await ctx.send("No tournaments found.")
-                    return
-
-                now = int(datetime.now().timestamp())
-                table = f"{'ID':<4} | {'Name':<30} | {'Date':<18} | Registration open\n"
-                table += "-"*82 + "\n"
-
-                for i, row in enumerate(rows):
-                    reg_open = "Yes" if row["regis_start"] <= now <= row["regis_end"] else "No"
-                    date_str = f"<t:{row['date']}:F>"
-                    formatstring = "{:<4} | {:<30} | {:<18} | {}\n"
-                    table += formatstring.format(row['id'], row['name'], date_str, reg_open)
+        return
 
-                table += "\nUse `-ti <ID>` to view full info."
-                await ctx.send(f"```\n{table}\n```")
+    view = TournamentView(ctx.author.id)
+    view.message = await ctx.send(await view.render(), view=view)
 
 
 @bot.hybrid_command(name='set_tournament',
@@ -725,10 +2246,10 @@ async def set_tournament (ctx: commands.Context,
                 await ctx.send("Invalid date/time format detected. Please double-check your inputs.")
                 continue
 
-            tour_id = await tour_id_gen(timestamp=tournament_date_unix)
-            logging.debug("tour_id: %s (%s)", tour_id, type(tour_id))
             try:
                 async with connect_db() as db:
+                    tour_id = await tour_id_gen(db, timestamp=tournament_date_unix)
+                    logging.debug("tour_id: %s (%s)", tour_id, type(tour_id))
                     await db.execute('''
                                     INSERT INTO tournament 
                                      (id, name, date, regis_start, regis_end, min_rank, max_rank, info) VALUES
@@ -750,6 +2271,7 @@ async def set_tournament (ctx: commands.Context,
                 await ctx.send(f"Database error: {e}")
                 break
 
+            tournament_scheduler.add(tour_id, data['Tournament name'], regis_start_unix, regis_end_unix, tournament_date_unix)
             await ctx.send("Tournament has been set successfully!")
             break
         elif ans.isdigit():
@@ -825,67 +2347,180 @@ Aliases: tr
 async def tournament_register(ctx: commands.Context, tour_id: str):
     discord_id = str(ctx.author.id)
 
-    async with connect_db() as db:
-        async with db.execute("SELECT tetrio_username FROM users WHERE discord_id = ?", (discord_id,)) as c:
-            user_row = await c.fetchone()
-            if not user_row or not user_row["tetrio_username"]:
-                await ctx.send("You are not linked to a Tetr.io account.")
-                return
-            username = user_row["tetrio_username"]
+    profile = await get_profile(discord_id=discord_id)
+    if not profile:
+        await ctx.send("You are not linked to a Tetr.io account.")
+        return
+    username = profile["tetrio_username"]
 
+    async with connect_db(readonly=True) as db:
         async with db.execute("SELECT * FROM tournament WHERE id = ?", (tour_id,)) as c:
             tour_row = await c.fetchone()
             if not tour_row:
                 await ctx.send(f"Tournament ID `{tour_id}` not found.")
                 return
 
-        min_rank = tour_row["min_rank"]
-        max_rank = tour_row["max_rank"]
+    min_rank = tour_row["min_rank"]
+    max_rank = tour_row["max_rank"]
 
-        async with db.execute("SELECT rank FROM tl WHERE tetrio_username = ?", (username,)) as c:
-            rank_row = await c.fetchone()
-            if not rank_row:
-                await ctx.send("Your rank info is not available yet. Please wait for the next update.")
-                return
-            user_rank = rank_row["rank"]
-
-        rank_order = list(rank_to_role.keys())
-        user_index = rank_order.index(user_rank) if user_rank in rank_order else -1
-        min_index = rank_order.index(min_rank) if min_rank in rank_order else 0
-        max_index = rank_order.index(max_rank) if max_rank in rank_order else len(rank_order)-1
+    user_rank = profile["rank"]
+    if user_rank is None:
+        await ctx.send("Your rank info is not available yet. Please wait for the next update.")
+        return
 
-        if user_index < min_index or user_index > max_index:
-            await ctx.send(f"Your rank `{user_rank}` does not meet the tournament requirements "
-                           f"(min: `{min_rank}`, max: `{max_rank}`).")
-            return
+    if not rank_eligible(user_rank, min_rank, max_rank):
+        await ctx.send(f"Your rank `{user_rank}` does not meet the tournament requirements "
+                       f"(min: `{min_rank}`, max: `{max_rank}`).")
+        return
 
+    async with connect_db() as db:
         async with db.execute(
             "SELECT 1 FROM tournament_regis WHERE tetrio_username = ? AND id = ?",
             (username, tour_id)
         ) as c:
-            if await c.fetchone():
-                await ctx.send("You are already registered for this tournament.")
-                return
+            registered = await c.fetchone() is not None
 
-        await db.execute(
-            "INSERT INTO tournament_regis (id, tetrio_username, tournament_name) VALUES (?, ?, ?)",
-            (tour_id, username, tour_row["name"])
-        )
-        await db.commit()
-        await ctx.send(f"Successfully registered for tournament `{tour_row['name']}`!")
+        if not registered:
+            await db.execute(
+                "INSERT INTO tournament_regis (id, tetrio_username, tournament_name) VALUES (?, ?, ?)",
+                (tour_id, username, tour_row["name"])
+            )
+            await db.commit()
+
+    if registered:
+        await ctx.send("You are already registered for this tournament.")
+        return
+
+    await ctx.send(f"Successfully registered for tournament `{tour_row['name']}`!")
+
+
+@bot.hybrid_command(
+    name='tournament_seeding',
+    description='Check all registrations of a tournament and export a TR seeding (mods only)',
+    aliases=['seed'],
+    help='''Re-check rank eligibility of every registered player and export a TR-seeded list (mods only).
+Aliases: seed
+
+**Usage:**
+`-seed <tour_id>`
+
+**Parameters**
+- `<tour_id>`: The ID of the tournament
+'''
+)
+@app_commands.guilds(*[discord.Object(id=guild_id) for guild_id in ALLOWED_GUILD])
+async def tournament_seeding(ctx: commands.Context, tour_id: str):
+    if not await mod_check(ctx):
+        await ctx.send("You don't have permission to use this command.")
+        return
+
+    if hasattr(ctx, "interaction") and ctx.interaction:
+        await ctx.defer()
+
+    tour_row, entrants = await seeding_rows(tour_id)
+    if tour_row is None:
+        await ctx.send(f"Tournament ID `{tour_id}` not found.")
+        return
+    if not entrants:
+        await ctx.send(f"No one has registered for `{tour_row['name']}` yet.")
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["seed", "tetrio_username", "discord_id", "rank", "tr", "rd", "status"])
+    eligible = 0
+    for entrant in entrants:
+        if entrant[5] == "ok":
+            eligible += 1
+            writer.writerow([eligible, *entrant])
+        else:
+            writer.writerow(["", *entrant])
+
+    file = discord.File(io.BytesIO(buffer.getvalue().encode()), filename=f"seeding-{tour_id}.csv")
+    await ctx.send(f"**{tour_row['name']}**: {eligible} eligible, {len(entrants) - eligible} flagged "
+                   f"(min: `{tour_row['min_rank']}`, max: `{tour_row['max_rank']}`).", file=file)
 
 
 @bot.hybrid_command(
     name="dump_db",
-    description="Prints the contents of the database (all tables) to Discord"
+    description="Exports the database (all tables) as a file",
+    help='''Exports the database (all tables) as a compressed file (mods only).
+
+**Usage:**
+`-dump_db [format]`
+
+**Parameters**
+- `[format]`: `jsonl` (gzip, default), `csv` (zip with one file per table) or `sqlite` (gzip backup snapshot)
+'''
 )
 @app_commands.guilds(*[discord.Object(id=guild_id) for guild_id in ALLOWED_GUILD])
-async def dump_db(ctx: commands.Context):
+@app_commands.describe(format="jsonl, csv or sqlite (default: jsonl)")
+async def dump_db(ctx: commands.Context, format: str = "jsonl"):
     if not await mod_check(ctx):
         await ctx.send("You don't have permission to use this command.")
         return
 
-    await print_db(ctx=ctx)
+    extensions = {"jsonl": "jsonl.gz", "csv": "zip", "sqlite": "db.gz"}
+    format = format.lower()
+    if format not in extensions:
+        await ctx.send(f"Unknown format `{format}`. Available: {', '.join(extensions.keys())}")
+        return
+
+    if hasattr(ctx, "interaction") and ctx.interaction:
+        await ctx.defer()
+
+    with tempfile.TemporaryFile() as out:
+        try:
+            await export_db(format, out)
+        except Exception as e:
+            logging.error(f"[dump_db] Export failed: {type(e).__name__}: {e}")
+            await ctx.send(f"Database error: {e}")
+            return
+
+        size = out.tell()
+        limit = ctx.guild.filesize_limit if ctx.guild else 8 * 1024 * 1024
+        if size > limit:
+            await ctx.send(f"The export is {size / 1024 / 1024:.1f} MB, over the {limit / 1024 / 1024:.0f} MB upload limit.")
+            return
+
+        out.seek(0)
+        filename = f"tac-db-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{extensions[format]}"
+        await ctx.send(file=discord.File(out, filename=filename))
+
+
+@bot.hybrid_command(
+    name="stats",
+    description="Show bot performance metrics (mods only)",
+    help='''Show API latency, retries, cache hit rates, DB write times, sweep durations and queue depths (mods only).
+
+**Usage:**
+`-stats`
+'''
+)
+@app_commands.guilds(*[discord.Object(id=guild_id) for guild_id in ALLOWED_GUILD])
+async def stats(ctx: commands.Context):
+    if not await mod_check(ctx):
+        await ctx.send("You don't have permission to use this command.")
+        return
+
+    if not METRICS_ENABLED:
+        await ctx.send("Metrics are disabled.")
+        return
+
+    lines = []
+    for metric in metric_registry:
+        for labels, value in metric.values().items():
+            lines.append(f"{metric.name}{metric_labels(metric.labels, labels)}: {metric.summary(value)}")
+
+    messages, chunk = [], ""
+    for line in lines or ["Nothing recorded yet."]:
+        if len(chunk) + len(line) > 1900:
+            messages.append(chunk)
+            chunk = ""
+        chunk += line + "\n"
+    messages.append(chunk)
+    for message in messages:
+        await ctx.send(f"```\n{message}```")
 
 
 #=============== events ===============#
@@ -897,70 +2532,249 @@ async def on_command_error(ctx: commands.Context, error):
         
         await ctx.send(msg)
 
+@bot.before_invoke
+async def on_command_invoke(ctx: commands.Context):
+    if ctx.command and ctx.command.name == "help":
+        return
+
+    try:
+        profile = await get_profile(discord_id=str(ctx.author.id))
+        if profile is not None:
+            await boost_refresh(profile["tetrio_username"])
+    except Exception as e:
+        logging.error(f"[before_invoke] Failed to boost refresh for {ctx.author.id}: {type(e).__name__}: {e}")
+
 @bot.event
 async def on_ready():
     await init_db()
+    await db_pool.open()
+    await response_cache.open()
+    await load_fingerprints()
+    await load_search_misses()
 
     global session
     if session is None:
         session = aiohttp.ClientSession()
 
+    await start_metrics_server()
     await on_start()
-    data_update.start()
+    #on_ready fires again after a reconnect, when the loops are already running
+    for loop in (data_update, league_update, history_compaction):
+        if not loop.is_running():
+            loop.start()
+
+    global role_sync_task, announce_task, tournament_task
+    if role_sync_task is None:
+        role_sync_task = asyncio.create_task(role_sync_worker())
+    if announce_task is None:
+        announce_task = asyncio.create_task(announcement_worker())
+    if tournament_task is None:
+        await tournament_scheduler.load()
+        tournament_task = asyncio.create_task(tournament_scheduler.run())
+    await sync_all_roles()
 
     logging.info('Logged in.\nv1.0')
 
 @bot.event
 async def on_close():
     global session
+    if refresh_pass is not None and not refresh_pass.done():
+        #the pass flushes what it already fetched while unwinding, so it must finish before the pool closes
+        refresh_pass.cancel()
+        try:
+            await refresh_pass
+        except asyncio.CancelledError:
+            pass
+    for task in list(inflight_requests.values()):
+        task.cancel()
+
     if session and not session.closed:
         await session.close()
 
+    await db_pool.close()
+    await response_cache.close()
+
+    global metrics_runner
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+        metrics_runner = None
+
+@bot.event
+async def on_guild_role_create(role: discord.Role):
+    role_cache.pop(role.guild.id, None)
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    role_cache.pop(role.guild.id, None)
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    role_cache.pop(after.guild.id, None)
+
 @bot.event
 async def on_member_join(member: discord.Member):
     discord_id = str(member.id)
-    rsp = await api_request(SEARCH_URL.format(discord_id))
-    users = rsp.get("data", {}).get("users", []) if rsp else []
-    username = users[0]["username"] if users else "null"
+    if search_blocked(discord_id):
+        return
+
+    username = await search_username(discord_id)
+    if username is None:
+        return
 
-    if not username or username == "null":
-        temp_bl.add(member.id)
+    if username == "null":
+        async with connect_db() as db:
+            await db.execute("INSERT OR REPLACE INTO search_misses(discord_id, failures, expires) VALUES (?, ?, ?)", record_miss(discord_id))
+            await db.commit()
         return
     
+    rsp = await api_request(SUMMARIES_URL.format(username))
+
     async with connect_db() as db:
+        await db.execute("DELETE FROM search_misses WHERE discord_id = ?", (discord_id,))
+        search_misses.pop(discord_id, None)
         await db.execute('''
                          INSERT OR IGNORE INTO users(discord_id, tetrio_username, ar, country)
                          VALUES (?, ?, ?, ?)
                          ''', (discord_id, username, 0, "null"))
 
-        if username != "null":
-            await db_update(db=db, username=username, discord_id=discord_id, rsp=await api_request(SUMMARIES_URL.format(username)))
-
+        written = await db_update(db=db, username=username, discord_id=discord_id, rsp=rsp)
         await db.commit()
 
+    if written:
+        after_commit(*written)
+
 #=============== tasks ===============#
-@tasks.loop(minutes=5)
-async def data_update(): 
+async def refresh_due_users():
+    started = time.monotonic()
+
+    async with connect_db(readonly=True) as db:
+        async with db.execute('''
+                              SELECT u.discord_id, u.tetrio_username, s.last_change, s.refresh_interval
+                              FROM users u
+                              LEFT JOIN refresh_schedule s ON s.tetrio_username = u.tetrio_username
+                              WHERE u.tetrio_username IS NOT NULL AND u.tetrio_username != 'null'
+                                AND COALESCE(s.next_refresh, 0) <= ?
+                              ORDER BY COALESCE(s.next_refresh, 0), COALESCE(s.last_refresh, 0)
+                              LIMIT ?
+                              ''', (int(time.time()), REFRESH_BUDGET_PER_MIN)) as c:
+            rows = [(row["discord_id"], row["tetrio_username"], row["last_change"], row["refresh_interval"]) for row in await c.fetchall()]
+
+    async def refresh_user(row):
+        discord_id, username, last_change, interval = row
+        try:
+            rsp = await api_request(SUMMARIES_URL.format(username))
+            if not rsp:
+                writer.reschedule(username, last_change or int(time.time()), failed=True, previous=interval)
+                return
+
+            changed = await writer.add(username=username, discord_id=discord_id, rsp=rsp)
+        except Exception as e:
+            #push the player back like any failed fetch, so a bad payload cannot pin them to the front of the queue
+            logging.error(f"[data_update] Failed to refresh {username}: {type(e).__name__}: {e}")
+            writer.reschedule(username, last_change or int(time.time()), failed=True, previous=interval)
+            return
+
+        if changed:
+            updated.append(username)
+            logging.debug(f"Updated data for {username}")
+
+        if league_covered.get(username, 0) > time.monotonic() - 2 * BULK_TL_INTERVAL:
+            changed -= {"tl", "tl_history"}
+        if changed:
+            last_change = int(time.time())
+        writer.reschedule(username, last_change or int(time.time()))
+
+    updated = []
+    writer = BatchWriter()
+    try:
+        await run_pool(rows, refresh_user)
+    finally:
+        await writer.flush()
+
+    sweep_durations["data_update"] = time.monotonic() - started
+    sweep_time.observe(sweep_durations["data_update"], "data_update")
+
+    if rows:
+        logging.info(f"Refreshed {len(rows)} due users ({len(updated)} changed) in {sweep_durations['data_update']:.1f}s")
+
+async def run_refresh_pass():
+    try:
+        await refresh_due_users()
+    except Exception as e:
+        logging.error(f"[data_update] Refresh pass failed: {type(e).__name__}: {e}")
+
+@tasks.loop(minutes=1)
+async def data_update():
     await bot.wait_until_ready()
 
-    async with connect_db() as db:
-        async with db.execute("SELECT discord_id, tetrio_username FROM users") as c:
-            rows = await c.fetchall()
-            for row in rows:
-                username = row["tetrio_username"]
-                discord_id = row["discord_id"]
+    #the pass runs beside the loop, so an overrun skips ticks instead of queueing back-to-back passes
+    global refresh_pass
+    if refresh_pass is not None and not refresh_pass.done():
+        sweep_skips.inc("data_update")
+        logging.warning("Previous refresh pass still running, skipping this tick")
+        return
+    refresh_pass = asyncio.create_task(run_refresh_pass())
 
-                if username in ("null", None):
-                    continue
+@tasks.loop(seconds=BULK_TL_INTERVAL)
+async def league_update():
+    await bot.wait_until_ready()
+
+    if not BULK_TL_REFRESH:
+        return
+
+    started = time.monotonic()
+
+    async with connect_db(readonly=True) as db:
+        async with db.execute('''
+                              SELECT tl.tetrio_username, tl.tr
+                              FROM tl
+                              JOIN users u ON u.tetrio_username = tl.tetrio_username
+                              WHERE tl.tr > 0 AND tl.rank != 'z'
+                              ''') as c:
+            players = {row[0]: row[1] async for row in c}
+
+    if not players:
+        return
+
+    try:
+        found = await fetch_league(players)
+    except Exception as e:
+        logging.error(f"[league_update] League sweep failed: {type(e).__name__}: {e}")
+        return
+
+    writer = BatchWriter()
+    try:
+        for username, entry in found.items():
+            await writer.add_rows(username, {"tl": league_rows(username, entry)})
+            league_covered[username] = time.monotonic()
+    finally:
+        await writer.flush()
+
+    sweep_durations["league_update"] = time.monotonic() - started
+    sweep_time.observe(sweep_durations["league_update"], "league_update")
+    logging.info(f"League sweep matched {len(found)}/{len(players)} players in {time.monotonic() - started:.1f}s")
 
-                rsp = await api_request(SUMMARIES_URL.format(username))
-                if rsp:
-                    await db_update(db=db, username=username, discord_id=discord_id, rsp=rsp)
-                    logging.info(f"Updated data for {username}")
+@tasks.loop(hours=1)
+async def history_compaction():
+    await bot.wait_until_ready()
 
-                await db.commit()
+    try:
+        await compact_history()
+    except Exception as e:
+        logging.error(f"[history_compaction] Compaction failed: {type(e).__name__}: {e}")
 
 #==============================#
-load_dotenv()
-bot.run(os.getenv('TOKEN',''))
+async def main():
+    async with bot:
+        try:
+            await bot.start(os.getenv('TOKEN',''))
+        finally:
+            await on_close()
+
+if __name__ == "__main__":
+    load_dotenv()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
 